@@ -5,6 +5,8 @@
 # required for Problem Set 2.
 ###########################################################################
 
+from types import MappingProxyType
+
 import numpy as np
 
 ########################################################################### 
@@ -35,3 +37,146 @@ y_port_low = np.array([ -0.0066, -0.0097, -0.0118, -0.0134, -0.0157, -0.0177, -0
 
 surf_up = np.array([1, 8.5, 16, 22.5, 29, 44, 58.5, 73, 87, 102, 122.5, 163, 206, 249, 292, 335, 378, 421, 442.5])
 surf_low = np.array([12.5, 27.5, 42.5, 56.5, 78, 99, 121, 159.5, 198, 246, 295, 343.5, 391])
+
+
+###########################################################################
+
+def _trapz_weights(x):
+    """
+    Weights w such that np.sum(w * f, axis=-1) equals the
+    trapezoidal integral of f(x) along the last axis.
+    """
+    dx = np.diff(x, axis=-1)
+    w = np.zeros(np.shape(x))
+    w[..., :-1] += 0.5 * dx
+    w[..., 1:] += 0.5 * dx
+    return w
+
+
+def force_weight_matrix(x_port, y_port, dydx, sign, chord):
+    """
+    Matrix mapping Cp of the taps of one surface to their
+    contribution to C_n, C_a and the nose-up moment about the
+    LE C_m_LE, see functions.calc_coefficients.
+
+    Input:
+        x_port, y_port : (ndarray) Tap coordinates [m], the last
+                         axis is the tap. Leading axes, e.g.
+                         resamples of the positions, are kept.
+        dydx           : (ndarray) Surface slope at the taps,
+                         broadcastable to x_port.
+        sign           : (int) -1 for the upper and 1 for the
+                         lower surface.
+        chord          : (float) Chord length [m].
+    Output:
+        matrix : (ndarray) Shape x_port.shape + (3,).
+    """
+    quad_weight = _trapz_weights(x_port)
+    matrix = np.empty(np.shape(x_port) + (3,))
+    matrix[..., 0] = sign * quad_weight / chord
+    matrix[..., 1] = -sign * quad_weight * dydx / chord
+    matrix[..., 2] = -sign * quad_weight * (x_port + dydx * y_port) / chord**2
+    return matrix
+
+
+class AirfoilGeometry:
+    """
+    Immutable pressure tap geometry of an airfoil model with
+    the derived quantities used by the force integration and
+    the plotting computed once.
+
+    The leading edge is at [0, 0] and the trailing edge at
+    [chord, 0]. All arrays are read-only.
+
+    Input:
+        x_port_up, y_port_up   : (array_like) Coordinates of the
+                                 upper pressure taps [m]
+        x_port_low, y_port_low : (array_like) Coordinates of the
+                                 lower pressure taps [m]
+        surf_up, surf_low      : (array_like or None) Distance of
+                                 the taps along the surface from
+                                 the LE [mm]. Default: None
+        chord                  : (float) Chord length [m].
+                                 Default: 0.45
+        upper_ind, lower_ind   : (array_like or None) Pressure
+                                 scanner port of each upper and
+                                 lower tap (0-indexed), as
+                                 'upper_ind' and 'lower_ind' in
+                                 the metadata. Default: None
+
+    Attributes (per surface, '_up' and '_low'):
+        x_points, y_points : Tap coordinates padded with the LE
+                             and TE points.
+        dydx               : Surface slope at the taps.
+        angle              : Angle of the surface tangent at the
+                             taps, as used for the pressure vectors.
+        normal             : Outward unit normal at the taps,
+                             shape (number of taps, 2).
+        panel_length       : Length of the straight panels between
+                             the padded points.
+        quad_weight        : Trapezoidal weights in x of the taps.
+        force_weights      : dict 'upper' and 'lower' with the
+                             matrices mapping Cp of the taps to
+                             C_n, C_a and C_m_LE, see
+                             functions.calc_coefficients.
+    """
+
+    def __init__(self, x_port_up, y_port_up, x_port_low, y_port_low,
+                 surf_up=None, surf_low=None, chord=0.45,
+                 upper_ind=None, lower_ind=None):
+        values = {'chord': float(chord)}
+        ports = {'up': (x_port_up, y_port_up, surf_up, upper_ind, -1),
+                 'low': (x_port_low, y_port_low, surf_low, lower_ind, 1)}
+        force_weights = {}
+        for side, (x_port, y_port, surf, ind, sign) in ports.items():
+            x_port = np.array(x_port, dtype=np.float64)
+            y_port = np.array(y_port, dtype=np.float64)
+            x_points = np.hstack([0, x_port, chord])
+            y_points = np.hstack([0, y_port, 0.0])
+
+            # Tangent direction from the neighbouring points
+            x_diff = np.gradient(x_points)[1:-1]
+            y_diff = np.gradient(y_points)[1:-1]
+            angle = np.arctan2(y_diff, x_diff)
+            normal = -sign * np.stack([-np.sin(angle), np.cos(angle)], axis=1)
+
+            # Gradients are needed for the axial pressure coefficient
+            dydx = np.gradient(y_points, x_points)[1:-1]
+            quad_weight = _trapz_weights(x_port)
+            force_weights['upper' if side == 'up' else 'lower'] = \
+                force_weight_matrix(x_port, y_port, dydx, sign, chord)
+
+            values.update({
+                'x_port_' + side: x_port,
+                'y_port_' + side: y_port,
+                'surf_' + side: None if surf is None else np.array(surf, dtype=np.float64),
+                ('upper_ind' if side == 'up' else 'lower_ind'):
+                    None if ind is None else np.array(ind, dtype=int),
+                'x_points_' + side: x_points,
+                'y_points_' + side: y_points,
+                'dydx_' + side: dydx,
+                'angle_' + side: angle,
+                'normal_' + side: normal,
+                'panel_length_' + side: np.hypot(np.diff(x_points), np.diff(y_points)),
+                'quad_weight_' + side: quad_weight,
+            })
+        values['force_weights'] = MappingProxyType(force_weights)
+
+        for key, value in values.items():
+            if isinstance(value, np.ndarray):
+                value.setflags(write=False)
+            elif isinstance(value, MappingProxyType):
+                for array in value.values():
+                    array.setflags(write=False)
+            object.__setattr__(self, key, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError('AirfoilGeometry is immutable')
+
+    def __delattr__(self, key):
+        raise AttributeError('AirfoilGeometry is immutable')
+
+
+# The NREL S826 model used in the lab
+S826 = AirfoilGeometry(x_port_up, y_port_up, x_port_low, y_port_low,
+                       surf_up, surf_low, chord=0.45)
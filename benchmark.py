@@ -0,0 +1,530 @@
+###########################################################################
+# Benchmarks of the reading, reduction and sweep pipeline.
+#
+# The lab's raw data is not needed, the files are synthetic: pressure
+# scanner files in the same 87-word frame format as the MPS4264 and
+# v7.3 (HDF5) .mat files with the fields read_mat.read expects.
+#
+# Every benchmark returns records with the wall clock time, throughput
+# (MB/s and frames/s) and the peak memory allocated during the run. The
+# records are printed as a table and written to a JSON file, so that
+# runs on different versions can be compared.
+#
+# Usage:
+#     python benchmark.py [--sizes 1e5 1e6] [--alphas 18] [--output FILE]
+###########################################################################
+
+import argparse
+from collections import OrderedDict
+import datetime
+import io
+import json
+import os
+import platform
+import tempfile
+import time as timer
+import tracemalloc
+
+import h5py
+import numpy as np
+
+from airfoil_geometry import AirfoilGeometry, S826, x_port_up, x_port_low
+import fluid_prop
+import functions as fnc
+import read_mat
+import read_press_scan_binary as rpsb
+import scan_stats
+import sweep
+import uncertainty
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# PTP scan start time (sec, ns) of the first capture of a synthetic
+# campaign, and the time [s] between the captures
+SCAN_START = (1650000000, 250000000)
+CAPTURE_INTERVAL = 60.0
+
+
+def write_synthetic_scan(fname, num_points, frame_rate=500.0, seed=0,
+                         chunk_frames=100000, t_start=SCAN_START):
+    """
+    Writes a synthetic pressure scanner file with num_points
+    frames in the MPS4264 binary format. The pressures are
+    random noise around a port dependent mean.
+
+    Input:
+        fname        : (str) Path to the output file.
+        num_points   : (int) Number of frames to write.
+        frame_rate   : (float) Frame rate in Hz. Default: 500
+        seed         : (int) Seed for the random numbers. Default: 0
+        chunk_frames : (int) Number of frames written at a time.
+                       Default: 100000
+        t_start      : (tuple) PTP scan start time (sec, ns).
+                       Default: SCAN_START
+    """
+    rng = np.random.default_rng(seed)
+    port_mean = np.linspace(-300, 100, 64).astype(np.float32)
+    with io.open(fname, 'wb') as fp:
+        for first in range(0, num_points, chunk_frames):
+            n = min(chunk_frames, num_points - first)
+            frames = np.zeros(n, dtype=rpsb.FRAME_DTYPE)
+            frame_number = np.arange(first, first + n)
+            t_ns = np.round(frame_number * 1e9 / frame_rate).astype(np.int64)
+            frames['packet_type'] = 10
+            frames['packet_size'] = rpsb.FRAME_BYTES
+            frames['frame_number'] = frame_number + 1
+            frames['frame_rate'] = frame_rate
+            frames['units_index'] = 6
+            frames['unit_conversion_factor'] = 1.0
+            frames['PTP_scan_start_time_sec'] = t_start[0]
+            frames['PTP_scan_start_time_ns'] = t_start[1]
+            frames['temperatures'] = 25 + rng.standard_normal((n, 8)) * 0.1
+            frames['pressures'] = port_mean \
+                + rng.standard_normal((n, 64)).astype(np.float32) * 5
+            frames['frame_time_sec'] = t_ns // 1000000000
+            frames['frame_time_ns'] = t_ns % 1000000000
+            frames.tofile(fp)
+
+
+def write_synthetic_mat(fname, alphas, group_name_prefix='Synthetic_370k',
+                        num_samples=10000, seed=0):
+    """
+    Writes a synthetic metadata file on the form of the
+    v7.3 .mat file saved by the Matlab script of the lab,
+    i.e. a HDF5 file with column-major 2D arrays, 1-indexed
+    indices and strings as char arrays.
+
+    Input:
+        fname             : (str) Path to the output file.
+        alphas            : (list) Angles of attack.
+        group_name_prefix : (str) Stored as 'Prefix'.
+        num_samples       : (int) Samples of the pitot tube and
+                            thermocouple per angle. Default: 10000
+        seed              : (int) Seed for the random numbers.
+                            Default: 0
+    """
+    rng = np.random.default_rng(seed)
+    num_alpha = len(alphas)
+    num_up = len(x_port_up)
+    num_low = len(x_port_low)
+    row = lambda values: np.atleast_2d(np.asarray(values, dtype=np.float64))
+    chars = lambda text: np.array([[ord(letter)] for letter in text], dtype=np.uint16)
+
+    with h5py.File(fname, 'w') as h5f:
+        h5f['alphas'] = row(alphas)
+        h5f['upper_ind'] = row(np.arange(num_up) + 1)
+        h5f['lower_ind'] = row(np.arange(num_up, num_up + num_low) + 1)
+        h5f['x_surf_up_real'] = row(x_port_up / 0.45)
+        h5f['x_surf_low_real'] = row(x_port_low / 0.45)
+        h5f['c'] = row(0.45)
+        h5f['t_stamp_0_1'] = row(0.0)
+        h5f['t_stamp_0_2'] = row(CAPTURE_INTERVAL * (num_alpha + 1))
+        h5f['t_stamp'] = row(CAPTURE_INTERVAL * np.arange(1, num_alpha + 1))
+        h5f['data_q_0_1'] = row(rng.normal(0.010, 0.001, 1000))
+        h5f['data_q_0_2'] = row(rng.normal(0.012, 0.001, 1000))
+        h5f['data_q_raw'] = rng.normal(1.5, 0.01, (num_alpha, num_samples))
+        h5f['data_T_raw'] = rng.normal(22.0, 0.1, (num_alpha, num_samples))
+        h5f['Vqfactor'] = row(80.0)
+        h5f['Patm'] = row(760.0)
+        h5f['Patm_end'] = row(759.0)
+        h5f['Prefix'] = chars(group_name_prefix)
+        h5f['Re'] = chars(group_name_prefix.split('_')[-1])
+        h5f['savefilename'] = chars(group_name_prefix + '_dataset')
+
+
+def write_synthetic_campaign(data_directory, group_name_prefix, alphas,
+                             num_points, num_samples=10000):
+    """
+    Writes a complete synthetic dataset in data_directory:
+    the metadata, two offset files and one pressure scanner
+    file of num_points frames per angle of attack, named as
+    expected by example_script and sweep. The captures start
+    at the times of the t_stamp fields of the metadata.
+    """
+    prefix = os.path.join(data_directory, group_name_prefix)
+    write_synthetic_mat(prefix + '_dataset.mat', alphas, group_name_prefix,
+                        num_samples)
+    t_start = lambda ind: (SCAN_START[0] + int(CAPTURE_INTERVAL * ind), SCAN_START[1])
+    write_synthetic_scan(prefix + '_offset1.dat', num_points, seed=1000,
+                         t_start=t_start(0))
+    write_synthetic_scan(prefix + '_offset2.dat', num_points, seed=1001,
+                         t_start=t_start(len(alphas) + 1))
+    for ind, alpha in enumerate(alphas):
+        write_synthetic_scan(prefix + '_a' + str(alpha) + '.dat', num_points,
+                             seed=ind, t_start=t_start(ind + 1))
+
+
+def read_legacy(fname):
+    """
+    The original frame by frame reader, kept as a reference
+    for the benchmarks.
+    """
+    with io.open(fname, 'rb') as fp:
+        bin_data = fp.read()
+
+    num_points = int(len(bin_data) / (4 * 87))
+    pressure = np.zeros((num_points, 64), dtype=np.float32)
+    time = np.zeros(num_points, dtype=np.float64)
+    t0_buff = np.frombuffer(bin_data, offset=8 * 4, count=2, dtype='int32')
+    t0 = t0_buff[0] + t0_buff[1] * 1e-9
+    for ind in range(num_points):
+        start = (19 + 87 * ind) * 4
+        pressure[ind, :] = np.frombuffer(bin_data, offset=start, count=64, dtype='float32')
+        time_buff = np.frombuffer(bin_data, offset=start+256, count=2, dtype='int32')
+        time[ind] = t0 + time_buff[0] + time_buff[1] * 1e-9
+
+    return time, pressure.T
+
+
+def check_layout(directory, num_points=1000):
+    """
+    Checks FRAME_DTYPE against the word offsets of the
+    MPS4264 frame, and that read_full and write_full are
+    the inverse of each other. Raises AssertionError on
+    any mismatch.
+    """
+    fname = os.path.join(directory, 'layout.dat')
+    write_synthetic_scan(fname, num_points)
+    words = np.fromfile(fname, dtype='<i4').reshape(-1, rpsb.FRAME_WORDS)
+    data = rpsb.read_full(fname)
+
+    # Word offset and count of each field in a frame
+    layout = [('packet_type', 0, 1), ('packet_size', 1, 1),
+              ('frame_number', 2, 1), ('scan_type', 3, 1),
+              ('frame_rate', 4, 1), ('valve_status', 5, 1),
+              ('units_index', 6, 1), ('unit_conversion_factor', 7, 1),
+              ('PTP_scan_start_time_sec', 8, 1), ('PTP_scan_start_time_ns', 9, 1),
+              ('external_trigger_time', 10, 1), ('temperatures', 11, 8),
+              ('pressures', 19, 64), ('frame_time_sec', 83, 1),
+              ('frame_time_ns', 84, 1), ('external_trigger_time_sec', 85, 1),
+              ('external_trigger_time_ns', 86, 1)]
+    assert [key for key, _, _ in layout] == list(data.keys())
+    for key, offset, count in layout:
+        value = data[key]
+        expected = words[:, offset:offset+count].view(value.dtype)
+        expected = expected[:, 0] if count == 1 else expected.T
+        assert np.array_equal(value, expected), key
+
+    copy = os.path.join(directory, 'layout_copy.dat')
+    rpsb.write_full(copy, data)
+    with io.open(fname, 'rb') as fp1, io.open(copy, 'rb') as fp2:
+        assert fp1.read() == fp2.read()
+
+    time, pressure = rpsb.read(fname)
+    assert np.array_equal(pressure, data['pressures'])
+    os.remove(fname)
+    os.remove(copy)
+
+
+def check_forces(num_taps=2000, rtol=1e-4, rtol_axial=1e-2):
+    """
+    Checks the force weights of AirfoilGeometry against the
+    direct integration of the pressure force -Cp * n * ds and
+    its moment r x F over the panels between the taps of a
+    dense cambered body. C_a converges slowly with the number
+    of taps due to the slope at the round LE, hence its own
+    tolerance. Raises AssertionError on any mismatch.
+    """
+    chord = 0.45
+    theta = np.linspace(0, np.pi, num_taps + 2)[1:-1]
+    x = chord * (1 - np.cos(theta)) / 2
+    x_c = x / chord
+    camber = 0.04 * chord * np.where(x_c < 0.4, (0.8 * x_c - x_c**2) / 0.16,
+                                     (0.2 + 0.8 * x_c - x_c**2) / 0.36)
+    thickness = 0.6 * chord * (0.2969 * np.sqrt(x_c) - 0.126 * x_c - 0.3516 * x_c**2
+                               + 0.2843 * x_c**3 - 0.1036 * x_c**4)
+    y_up, y_low = camber + thickness, camber - thickness
+    Cp_upper = 0.15 - 2.5 * np.exp(-x_c / 0.07) - 0.6 * (1 - x_c)
+    Cp_lower = 0.05 + 0.2 * (1 - x_c) + 0.8 * np.exp(-x_c / 0.07)
+    geometry = AirfoilGeometry(x, y_up, x, y_low, chord=chord)
+    coeffs = fnc.calc_coefficients(Cp_upper, Cp_lower, 0, geometry, x_ref=0)
+
+    # Force and nose-up moment about the LE of each panel, with the outward
+    # normal times the panel length (-dy, dx) on the upper and (dy, -dx) on
+    # the lower surface
+    force = np.zeros(2)
+    moment = 0.0
+    for y, Cp, sign in ((y_up, Cp_upper, 1), (y_low, Cp_lower, -1)):
+        x_mid, y_mid = (x[1:] + x[:-1]) / 2, (y[1:] + y[:-1]) / 2
+        Cp_mid = (Cp[1:] + Cp[:-1]) / 2
+        F_x = Cp_mid * sign * np.diff(y)
+        F_y = -Cp_mid * sign * np.diff(x)
+        force += [F_x.sum(), F_y.sum()]
+        moment -= np.sum(x_mid * F_y - y_mid * F_x)
+    assert np.isclose(coeffs['C_n'], force[1] / chord, rtol=rtol, atol=0)
+    assert np.isclose(coeffs['C_a'], force[0] / chord, rtol=rtol_axial, atol=0)
+    assert np.isclose(coeffs['C_m'], moment / chord**2, rtol=rtol, atol=0), \
+        (coeffs['C_m'], moment / chord**2)
+
+
+def check_tap_uncertainty(num_samples=4000, sigma_tap=0.2e-3, max_ratio=10):
+    """
+    Checks that the tap position error alone gives a spread
+    of C_d of the same order as that of C_l, and a bias well
+    below the spread, for a model pressure distribution with
+    a suction peak at the LE of the S826. Raises
+    AssertionError otherwise.
+    """
+    rng = np.random.default_rng(0)
+    weights = uncertainty.tap_force_weights(rng, S826, sigma_tap, num_samples)
+    x_up, x_low = S826.x_port_up / S826.chord, S826.x_port_low / S826.chord
+    for alpha in (4, 8, 12):
+        Cp_upper = 0.15 - alpha / 8 * (2.5 * np.exp(-x_up / 0.07) + 0.6 * (1 - x_up))
+        Cp_lower = 0.05 + 0.2 * (1 - x_low) + 0.8 * alpha / 8 * np.exp(-x_low / 0.07)
+        nominal = fnc.calc_coefficients(Cp_upper, Cp_lower, alpha, S826)
+        coeffs = fnc.calc_coefficients(Cp_upper[None, :], Cp_lower[None, :], alpha, weights)
+        std_C_l, std_C_d = coeffs['C_l'].std(), coeffs['C_d'].std()
+        assert np.all(np.isfinite(coeffs['C_d'])), alpha
+        assert std_C_d < max_ratio * std_C_l, (alpha, std_C_l, std_C_d)
+        for key in ('C_l', 'C_d'):
+            error = abs(coeffs[key].mean() - nominal[key])
+            assert error < 0.5 * coeffs[key].std(), (alpha, key)
+
+
+def _measure(func, repeat=3):
+    """
+    Returns the best wall clock time of func() over repeat
+    runs, and the peak memory (bytes) allocated by Python
+    and NumPy during one additional traced run.
+    """
+    best = np.inf
+    for _ in range(repeat):
+        tic = timer.perf_counter()
+        func()
+        best = min(best, timer.perf_counter() - tic)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def _record(benchmark, case, seconds, peak, num_points=None, nbytes=None):
+    """Collects the result of one measurement."""
+    record = OrderedDict()
+    record['benchmark'] = benchmark
+    record['case'] = case
+    record['num_points'] = num_points
+    record['nbytes'] = nbytes
+    record['seconds'] = seconds
+    record['MB/s'] = None if nbytes is None else nbytes / seconds / 1e6
+    record['frames/s'] = None if num_points is None else num_points / seconds
+    record['peak_MB'] = peak / 1e6
+    return record
+
+
+def bench_read(num_points, directory, legacy_max=10**6):
+    """
+    Times the legacy reader against rpsb.read, in memory and
+    memory-mapped, and rpsb.read_full on a synthetic file of
+    num_points frames. The mean over time is included so that
+    the memory-mapped reader actually touches the data.
+    """
+    fname = os.path.join(directory, 'bench_{:d}.dat'.format(num_points))
+    write_synthetic_scan(fname, num_points)
+    nbytes = os.path.getsize(fname)
+
+    cases = OrderedDict()
+    if num_points <= legacy_max:
+        cases['legacy'] = lambda: read_legacy(fname)[1].mean(axis=1)
+    cases['read'] = lambda: rpsb.read(fname)[1].mean(axis=1)
+    cases['read(mmap)'] = lambda: rpsb.read(fname, mmap=True)[1].mean(axis=1)
+    cases['read_full'] = lambda: rpsb.read_full(fname)['temperatures'].mean(axis=1)
+
+    records = []
+    for case, func in cases.items():
+        seconds, peak = _measure(func, repeat=1 if case == 'legacy' else 3)
+        records.append(_record('decode', case, seconds, peak, num_points, nbytes))
+
+    if num_points <= legacy_max:
+        t_new, p_new = rpsb.read(fname)
+        t_old, p_old = read_legacy(fname)
+        assert np.array_equal(t_new, t_old) and np.array_equal(p_new, p_old)
+    os.remove(fname)
+    return records
+
+
+def bench_reduce(num_points, directory):
+    """
+    Times the reduction of a file of num_points frames to the
+    temporal mean of every port, by reading the whole file
+    and by streaming it with scan_stats.
+    """
+    fname = os.path.join(directory, 'bench_{:d}.dat'.format(num_points))
+    write_synthetic_scan(fname, num_points)
+    nbytes = os.path.getsize(fname)
+
+    cases = OrderedDict()
+    cases['read + np.mean'] = lambda: np.mean(rpsb.read(fname)[1], axis=1)
+    cases['port_mean'] = lambda: scan_stats.port_mean(fname)
+    cases['port_stats'] = lambda: scan_stats.port_stats(fname)
+
+    records = []
+    for case, func in cases.items():
+        seconds, peak = _measure(func)
+        records.append(_record('reduce', case, seconds, peak, num_points, nbytes))
+    os.remove(fname)
+    return records
+
+
+def bench_read_mat(directory, num_alpha=18, num_samples=10000):
+    """
+    Times loading the metadata of a sweep with num_alpha
+    angles, all fields against only the fields of the sweep.
+    """
+    fname = os.path.join(directory, 'bench_dataset.mat')
+    write_synthetic_mat(fname, list(range(num_alpha)), num_samples=num_samples)
+    nbytes = os.path.getsize(fname)
+
+    cases = OrderedDict()
+    cases['read'] = lambda: read_mat.read(fname)
+    cases['read(fields)'] = lambda: read_mat.read(fname, fields=sweep.META_FIELDS)
+
+    records = []
+    for case, func in cases.items():
+        seconds, peak = _measure(func)
+        records.append(_record('read_mat', case, seconds, peak, nbytes=nbytes))
+    os.remove(fname)
+    return records
+
+
+def bench_sweep(num_points, directory, num_alpha=18):
+    """
+    Times sweep.run_sweep on a synthetic dataset of num_alpha
+    angles with num_points frames each, in this process and
+    with a process pool.
+    """
+    data_directory = os.path.join(directory, 'sweep_{:d}'.format(num_points)) + os.sep
+    os.makedirs(data_directory)
+    alphas = list(range(-4, num_alpha - 4))
+    write_synthetic_campaign(data_directory, 'Synthetic_370k', alphas, num_points)
+    total_points = (num_alpha + 2) * num_points
+    nbytes = total_points * rpsb.FRAME_BYTES
+
+    cases = OrderedDict()
+    cases['serial'] = lambda: sweep.run_sweep(data_directory, 'Synthetic_370k',
+                                              processes=1)
+    cases['pool'] = lambda: sweep.run_sweep(data_directory, 'Synthetic_370k')
+
+    records = []
+    for case, func in cases.items():
+        seconds, peak = _measure(func, repeat=2)
+        records.append(_record('sweep', case, seconds, peak, total_points, nbytes))
+    for name in os.listdir(data_directory):
+        os.remove(os.path.join(data_directory, name))
+    os.rmdir(data_directory)
+    return records
+
+
+def bench_fluid_prop(num_samples=10**7, num_scalar=10**4):
+    """
+    Times fluid_prop_array on num_samples temperatures and
+    pressures against fluid_prop called on arrays and the
+    scalar loop (extrapolated from num_scalar calls), and
+    checks that they agree to rounding errors.
+    """
+    rng = np.random.default_rng(0)
+    T_atm = rng.uniform(15, 35, num_samples)
+    P_atm = rng.uniform(730, 770, num_samples)
+
+    scalar = [fluid_prop.fluid_prop(T, P) for T, P in zip(T_atm[:num_scalar],
+                                                         P_atm[:num_scalar])]
+    vector = fluid_prop.fluid_prop_array(T_atm[:num_scalar], P_atm[:num_scalar])
+    for ind in range(4):
+        expected = np.array([values[ind] for values in scalar])
+        assert np.allclose(vector[ind], expected, rtol=1e-14, atol=0)
+
+    scalar_loop = lambda: [fluid_prop.fluid_prop(T, P) for T, P in
+                           zip(T_atm[:num_scalar], P_atm[:num_scalar])]
+    seconds, peak = _measure(scalar_loop, repeat=1)
+    records = [_record('fluid_prop', 'scalar loop', seconds * num_samples / num_scalar,
+                       peak, num_samples)]
+    cases = OrderedDict()
+    cases['fluid_prop'] = lambda: fluid_prop.fluid_prop(T_atm, P_atm)
+    cases['fluid_prop_array'] = lambda: fluid_prop.fluid_prop_array(T_atm, P_atm)
+    for case, func in cases.items():
+        seconds, peak = _measure(func)
+        records.append(_record('fluid_prop', case, seconds, peak, num_samples))
+    return records
+
+
+def max_rss_mb():
+    """Peak resident set size of this process in MB, or None."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss / 1e6 if platform.system() == 'Darwin' else max_rss / 1e3
+
+
+def print_records(records):
+    """Prints the records as a table."""
+    print('{:<12s} {:<18s} {:>10s} {:>10s} {:>10s} {:>12s} {:>10s}'.format(
+        'benchmark', 'case', 'frames', 'seconds', 'MB/s', 'frames/s', 'peak MB'))
+    fmt = lambda value, spec: format(value, spec) if value is not None else '-'
+    for record in records:
+        print('{:<12s} {:<18s} {:>10s} {:>10.4f} {:>10s} {:>12s} {:>10.1f}'.format(
+            record['benchmark'], record['case'], fmt(record['num_points'], 'd'),
+            record['seconds'], fmt(record['MB/s'], '.1f'),
+            fmt(record['frames/s'], '.3g'), record['peak_MB']))
+
+
+def run(sizes, num_alpha=18, sweep_max=10**6):
+    """
+    Runs all benchmarks for the given numbers of frames.
+    The sweep is only run for sizes up to sweep_max.
+
+    Output:
+        report : (dict) 'system' information, 'records' of all
+                 measurements and the 'max_rss_MB' of the run.
+    """
+    records = []
+    with tempfile.TemporaryDirectory() as directory:
+        check_layout(directory)
+        check_forces()
+        check_tap_uncertainty()
+        for num_points in sizes:
+            records += bench_read(num_points, directory)
+            records += bench_reduce(num_points, directory)
+        records += bench_read_mat(directory, num_alpha)
+        for num_points in sizes:
+            if num_points <= sweep_max:
+                records += bench_sweep(num_points, directory, num_alpha)
+    records += bench_fluid_prop()
+
+    report = OrderedDict()
+    report['system'] = OrderedDict([
+        ('date', datetime.datetime.now().isoformat(timespec='seconds')),
+        ('platform', platform.platform()),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('h5py', h5py.__version__),
+        ('cpu_count', os.cpu_count()),
+    ])
+    report['records'] = records
+    report['max_rss_MB'] = max_rss_mb()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks of the lab_aero pipeline')
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1e5, 1e6],
+                        help='Number of frames of the synthetic scanner files')
+    parser.add_argument('--alphas', type=int, default=18,
+                        help='Number of angles of attack in the sweep')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='JSON file for the results')
+    args = parser.parse_args()
+
+    report = run([int(size) for size in args.sizes], args.alphas)
+    print_records(report['records'])
+    print('Peak RSS: {:s} MB'.format(
+        'n/a' if report['max_rss_MB'] is None else '{:.1f}'.format(report['max_rss_MB'])))
+    with io.open(args.output, 'w') as fp:
+        json.dump(report, fp, indent=2)
+    print('Results written to {:s}'.format(args.output))
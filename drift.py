@@ -0,0 +1,139 @@
+###########################################################################
+# Time-resolved offset drift correction of the pressure scanner.
+#
+# The offsets of the ports are measured (with the tunnel off) a number
+# of times during a campaign. OffsetDrift interpolates them in time,
+# piecewise linearly or with a cubic spline, and subtracts the offset
+# from every frame of a capture at the time stamp of that frame.
+#
+# Usage:
+#     drift = OffsetDrift.from_captures([prefix + '_offset1.dat',
+#                                        prefix + '_offset2.dat'])
+#     time, pressure = rpsb.read(prefix + '_a10.dat')
+#     pressure = drift.correct(time, pressure)
+###########################################################################
+
+import numpy as np
+import scipy.interpolate
+
+import profiling
+import read_press_scan_binary as rpsb
+
+
+class OffsetDrift:
+    """
+    Offset of every port of the pressure scanner as a
+    function of time, interpolated between two or more
+    offset measurements. Outside the measurements the
+    first and last interval (or spline piece) is
+    extrapolated.
+
+    Input:
+        times   : (array_like, 1D) Time of each offset
+                  measurement, increasing.
+        offsets : (array_like, 2D) Offset of each port, first
+                  index is the measurement, second index is
+                  the port.
+        kind    : (str) 'linear' for piecewise linear drift
+                  or 'cubic' for a cubic spline (at least
+                  three measurements). Default: 'linear'
+    """
+
+    # Number of frames corrected at a time
+    block_frames = 8192
+
+    def __init__(self, times, offsets, kind='linear'):
+        times = np.asarray(times, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.float64)
+        if offsets.ndim == 1:
+            offsets = offsets[:, None]
+        if len(times) < 2 or len(times) != len(offsets):
+            raise ValueError('Need one offset per time and at least two times')
+        if np.any(np.diff(times) <= 0):
+            raise ValueError('The times of the offset measurements must increase')
+        if kind not in ('linear', 'cubic'):
+            raise ValueError("kind must be 'linear' or 'cubic', not {!r}".format(kind))
+        if kind == 'cubic' and len(times) < 3:
+            raise ValueError("kind='cubic' needs at least three offset measurements")
+
+        self.times = times
+        self.offsets = offsets
+        self.kind = kind
+        with profiling.stage('interpolant'):
+            if kind == 'linear':
+                # Offset and slope of every interval, with the ports first
+                self._start = offsets[:-1].T.copy()
+                self._slope = (np.diff(offsets, axis=0) / np.diff(times)[:, None]).T.copy()
+            else:
+                self._spline = scipy.interpolate.CubicSpline(times, offsets, axis=0,
+                                                             extrapolate=True)
+
+    @classmethod
+    def from_captures(cls, fnames, kind='linear', chunk_frames=16384):
+        """
+        Creates the drift from pressure scanner files of offset
+        measurements. The time of each measurement is the mean
+        of its frame time stamps, so it is on the same clock as
+        the time returned by read_press_scan_binary.read.
+        """
+        times = []
+        offsets = []
+        for fname in fnames:
+            total_time = 0.0
+            total = np.zeros(64)
+            count = 0
+            for time, pressure in rpsb.iter_frames(fname, chunk_frames):
+                total_time += time.sum()
+                total += pressure.T.sum(axis=0, dtype=np.float64)
+                count += len(time)
+            times.append(total_time / count)
+            offsets.append(total / count)
+        return cls(times, offsets, kind)
+
+    def __call__(self, time):
+        """
+        Returns the offset of every port at the given times,
+        first index is the port, second index is time.
+        """
+        time = np.atleast_1d(np.asarray(time, dtype=np.float64))
+        if self.kind == 'cubic':
+            return self._spline(time).T
+        ind = np.clip(np.searchsorted(self.times, time, side='right') - 1,
+                      0, len(self.times) - 2)
+        return self._start[:, ind] + self._slope[:, ind] * (time - self.times[ind])
+
+    def correct(self, time, pressure, out=None):
+        """
+        Subtracts the offset at the time of each frame from
+        the pressure, vectorized over ports and frames.
+
+        Input:
+            time     : (ndarray, 1D) Time of each frame.
+            pressure : (ndarray, 2D) Pressure, first index is
+                       the port, second index is time, as
+                       returned by read_press_scan_binary.read.
+            out      : (ndarray or None) Output array, may be
+                       pressure itself to correct in place.
+                       Default: None (new array of the same
+                       dtype as pressure)
+        Output:
+            pressure : (ndarray, 2D) Corrected pressure.
+        """
+        if out is None:
+            out = np.array(pressure, dtype=np.result_type(pressure.dtype, np.float32))
+        elif out is not pressure:
+            out[...] = pressure
+        # Blocks of frames keep the temporary offsets small
+        for start in range(0, len(time), self.block_frames):
+            end = start + self.block_frames
+            out[:, start:end] -= self(time[start:end]).astype(out.dtype, copy=False)
+        return out
+
+    def iter_corrected(self, fname, chunk_frames=100000):
+        """
+        Iterates over the pressure scanner file fname in blocks
+        as read_press_scan_binary.iter_frames, with the offset
+        drift subtracted from every frame.
+        """
+        for time, pressure in rpsb.iter_frames(fname, chunk_frames):
+            yield time, self.correct(time, pressure, out=pressure)
@@ -4,13 +4,14 @@ import scipy as sp
 import scipy.interpolate
 import fluid_prop
 import functions as fnc
+import profiling
 
 from airfoil_geometry import x_port_up, y_port_up, x_port_low, y_port_low
 
 #plt.rcParams['text.usetex'] = True
 
 import read_mat
-import read_press_scan_binary as rpsb
+import scan_stats
 
 
 def example_calculation(data_directory, group_name_prefix, alpha):
@@ -43,35 +44,37 @@ def example_calculation(data_directory, group_name_prefix, alpha):
     # Time at which data for chosen AoA was measured
     t_alpha = meta['t_stamp'][alpha_index]
 
-    # Extract offset pressure measurements from pressure scanner files, split
-    # data between upper and lower surfaces, and calculate their temporal means
-    _, PS_offset1 = rpsb.read(data_directory + group_name_prefix + '_offset1.dat')
-    _, PS_offset2 = rpsb.read(data_directory + group_name_prefix + '_offset2.dat')
-    PS_lower_offset_1 = np.mean(PS_offset1[inds_lower, :], axis=1)
-    PS_upper_offset_1 = np.mean(PS_offset1[inds_upper, :], axis=1)
-    PS_lower_offset_2 = np.mean(PS_offset2[inds_lower, :], axis=1)
-    PS_upper_offset_2 = np.mean(PS_offset2[inds_upper, :], axis=1)
+    # Calculate the temporal means of the offset pressure measurements from the
+    # pressure scanner files (block by block, so the memory use is constant),
+    # and split the data between upper and lower surfaces
+    PS_offset1 = scan_stats.port_mean(data_directory + group_name_prefix + '_offset1.dat')
+    PS_offset2 = scan_stats.port_mean(data_directory + group_name_prefix + '_offset2.dat')
+    PS_lower_offset_1 = PS_offset1[inds_lower]
+    PS_upper_offset_1 = PS_offset1[inds_upper]
+    PS_lower_offset_2 = PS_offset2[inds_lower]
+    PS_upper_offset_2 = PS_offset2[inds_upper]
 
     # Create a multivariate interpolant function for the pressure scanner offsets.
     # This is a function that returns (as an array) the linearly interpolated value of
     # the offset pressure for each pressure port at any time between the offset measurements
     # if we assume a linear drift. Separate interpolants are made for the upper and
     # lower surfaces (but we could have easily done this in one go if we didn't split the data earlier).
-    PS_lower_interpolant = sp.interpolate.interp1d(
-        np.array([t_offset_1, t_offset_2]),
-        np.array([PS_lower_offset_1, PS_lower_offset_2]).T
-    )
-
-    PS_upper_interpolant = sp.interpolate.interp1d(
-        np.array([t_offset_1, t_offset_2]),
-        np.array([PS_upper_offset_1, PS_upper_offset_2]).T
-    )
-
-    # Extract pressure scanner data for the chosen angle of attack, split data 
-    # between upper and lower surfaces, and calculate their temporal means
-    _, p = rpsb.read(data_directory + group_name_prefix + '_a' + str(int(alphas[alpha_index])) + '.dat')
-    PS_upper_alpha = np.mean(p[inds_upper, :], axis=1)
-    PS_lower_alpha = np.mean(p[inds_lower, :], axis=1)
+    with profiling.stage('interpolant'):
+        PS_lower_interpolant = sp.interpolate.interp1d(
+            np.array([t_offset_1, t_offset_2]),
+            np.array([PS_lower_offset_1, PS_lower_offset_2]).T
+        )
+
+        PS_upper_interpolant = sp.interpolate.interp1d(
+            np.array([t_offset_1, t_offset_2]),
+            np.array([PS_upper_offset_1, PS_upper_offset_2]).T
+        )
+
+    # Calculate the temporal means of the pressure scanner data for the chosen
+    # angle of attack, and split data between upper and lower surfaces
+    p_mean = scan_stats.port_mean(data_directory + group_name_prefix + '_a' + str(int(alphas[alpha_index])) + '.dat')
+    PS_upper_alpha = p_mean[inds_upper]
+    PS_lower_alpha = p_mean[inds_lower]
 
     # Subtract the interpolated offset at the time of the measurement
     # Use .T to make sure arrays have the same orientation
@@ -112,22 +115,23 @@ def example_calculation(data_directory, group_name_prefix, alpha):
     Re_c_alpha = U_alpha * meta['c'] / nu_alpha
 
     # Plot the pressure profile as -Cp
-    fig, (ax, ax2) = plt.subplots(2,1,sharex=True)
-    fig.dpi = 150
-    ax.axvline(x = 0, color='gray')
-    ax.axvline(x = 1, color='gray')
-    ax2.axvline(x = 0, color='gray')
-    ax2.axvline(x = 1, color='gray')
-    ax.plot(x_upper, -PS_upper_alpha.T / q_alpha, '-ob', label=r'Upper surface', linewidth=1, markersize=4)
-    ax.plot(x_lower, -PS_lower_alpha.T / q_alpha, '-or', label=r'Lower surface', linewidth=1, markersize=4)
-    ax.set_title('$\\alpha= %s ^{\\circ}$' % alpha, fontsize=16)
-    ax.legend(loc='best')
-    ax.set_xlabel(r'$x/c$', fontsize=16)
-    ax.set_ylabel(r'$-Cp$', fontsize=16)
-    ax.set_xlim((0, 1))
-
-    chord = 0.45
-    fnc.plot_pressure_vectors(ax2, x_port_up, y_port_up, x_port_low, y_port_low, PS_upper_alpha, PS_lower_alpha, chord)
+    with profiling.stage('matplotlib'):
+        fig, (ax, ax2) = plt.subplots(2,1,sharex=True)
+        fig.dpi = 150
+        ax.axvline(x = 0, color='gray')
+        ax.axvline(x = 1, color='gray')
+        ax2.axvline(x = 0, color='gray')
+        ax2.axvline(x = 1, color='gray')
+        ax.plot(x_upper, -PS_upper_alpha.T / q_alpha, '-ob', label=r'Upper surface', linewidth=1, markersize=4)
+        ax.plot(x_lower, -PS_lower_alpha.T / q_alpha, '-or', label=r'Lower surface', linewidth=1, markersize=4)
+        ax.set_title('$\\alpha= %s ^{\\circ}$' % alpha, fontsize=16)
+        ax.legend(loc='best')
+        ax.set_xlabel(r'$x/c$', fontsize=16)
+        ax.set_ylabel(r'$-Cp$', fontsize=16)
+        ax.set_xlim((0, 1))
+
+        chord = 0.45
+        fnc.plot_pressure_vectors(ax2, x_port_up, y_port_up, x_port_low, y_port_low, PS_upper_alpha, PS_lower_alpha, chord)
     plt.show()
 
     # print results
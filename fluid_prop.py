@@ -1,3 +1,19 @@
+import numpy as np
+
+import profiling
+
+rho_w4 = 1000  # density of water at 4oC in kg/m^3
+R_air = 286.9  # j/kg K
+#g = 9.797  # m/s^2
+g = 9.805  # m/s^2
+
+C_air = 1.458e-6    #Curve fit constant from thermodynamics
+S_air = 110.4      #Another curve fit constant!
+a1 = 583.63        # This is the coefficient for a quick curve fit made based on the thermodynamic data foun in 'Fundamental of Heat and Mass Transfer', 4th Ed. by Incropera and DeWitt
+a2 = 3.0514        # same as a1
+a3 = -0.0056      # same as a1
+
+
 def fluid_prop(T_atm, P_atm):
     """
     This program computes fluid properties of air and water from the inputed
@@ -6,26 +22,69 @@ def fluid_prop(T_atm, P_atm):
     Pressure given in mmHg
 
     - Philippe Lavoie 28-07-2003
-    
+
     Converted to Python by Abhijat Verma 27-03-2022
     """
 
-    rho_w4 = 1000  # density of water at 4oC in kg/m^3
-    R_air = 286.9  # j/kg K
-    #g = 9.797  # m/s^2
-    g = 9.805  # m/s^2
-
-    C_air = 1.458e-6    #Curve fit constant from thermodynamics
-    S_air = 110.4      #Another curve fit constant!
-    a1 = 583.63        # This is the coefficient for a quick curve fit made based on the thermodynamic data foun in 'Fundamental of Heat and Mass Transfer', 4th Ed. by Incropera and DeWitt
-    a2 = 3.0514        # same as a1
-    a3 = -0.0056      # same as a1
-    SG_Hg = 13.6 - 0.0024 * T_atm  #Specific gravity of Hg
-
-    P_atm = rho_w4 * SG_Hg * P_atm * g / 1000  # Give pressure in Pascals
-    T_atm = T_atm + 273.15     # Changes temperature to Kelvin
-
-    rho_air = P_atm / (R_air * T_atm)
-    visc_air = (C_air * T_atm**(3/2)) / (S_air + T_atm)
-    rho_w = a1 + a2 * T_atm + a3 * T_atm**2
-    return rho_air, visc_air, rho_w, g
\ No newline at end of file
+    with profiling.stage('fluid_prop', frames=np.size(T_atm)):
+        SG_Hg = 13.6 - 0.0024 * T_atm  #Specific gravity of Hg
+
+        P_atm = rho_w4 * SG_Hg * P_atm * g / 1000  # Give pressure in Pascals
+        T_atm = T_atm + 273.15     # Changes temperature to Kelvin
+
+        rho_air = P_atm / (R_air * T_atm)
+        visc_air = (C_air * T_atm**(3/2)) / (S_air + T_atm)
+        rho_w = a1 + a2 * T_atm + a3 * T_atm**2
+    return rho_air, visc_air, rho_w, g
+
+
+def fluid_prop_array(T_atm, P_atm):
+    """
+    Array version of fluid_prop for long series, e.g. one
+    value per sample of the thermocouple data with the
+    atmospheric pressure interpolated to each sample.
+    T_atm and P_atm can be scalars, lists or arrays of any
+    broadcastable shape, and all four outputs are arrays
+    of the broadcast shape.
+
+    The same fits as in fluid_prop are evaluated in place
+    with as few temporary arrays as possible, the results
+    agree with fluid_prop to rounding errors.
+
+    Input:
+        T_atm : (array_like) Temperature in Celsius
+        P_atm : (array_like) Pressure in mmHg
+    Output:
+        rho_air  : (ndarray) Density of air [kg/m^3]
+        visc_air : (ndarray) Dynamic viscosity of air [kg/(m s)]
+        rho_w    : (ndarray) Density of water [kg/m^3]
+        g        : (ndarray) Gravitational acceleration [m/s^2]
+    """
+    T_atm = np.asarray(T_atm, dtype=np.float64)
+    P_atm = np.asarray(P_atm, dtype=np.float64)
+    shape = np.broadcast_shapes(T_atm.shape, P_atm.shape)
+    with profiling.stage('fluid_prop', frames=int(np.prod(shape))):
+        return _fluid_prop_array(T_atm, P_atm, shape)
+
+
+def _fluid_prop_array(T_atm, P_atm, shape):
+    """Evaluates fluid_prop_array for the broadcast shape."""
+
+    # Pressure in Pascals divided by R_air
+    rho_air = np.multiply(T_atm, -0.0024 * rho_w4 * g / 1000 / R_air)
+    rho_air += 13.6 * rho_w4 * g / 1000 / R_air
+    rho_air = np.multiply(rho_air, P_atm, out=np.empty(shape))
+
+    T_K = np.add(T_atm, 273.15, out=np.empty(shape))
+    rho_air /= T_K
+
+    visc_air = np.sqrt(T_K)
+    visc_air *= T_K
+    visc_air *= C_air
+    visc_air /= np.add(T_K, S_air)
+
+    rho_w = np.multiply(T_K, a3)
+    rho_w += a2
+    rho_w *= T_K
+    rho_w += a1
+    return rho_air, visc_air, rho_w, np.full(shape, g)
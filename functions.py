@@ -1,3 +1,6 @@
+from collections import OrderedDict
+
+from airfoil_geometry import AirfoilGeometry, S826
 from fluid_prop import fluid_prop
 import numpy as np
 
@@ -8,64 +11,112 @@ def plot_airfoil(ax, x_points_up, x_points_low, y_points_up, y_points_low, c):
     ax.axis('equal')
 
 
-def plot_pressure_vectors(ax, x_port_up, y_port_up, x_port_low, y_port_low, P_Dist_upper, P_Dist_lower, c):
+def plot_pressure_vectors(ax, x_port_up, y_port_up, x_port_low, y_port_low, P_Dist_upper, P_Dist_lower, c,
+                          geometry=None):
     """Calculating the positions of the airfoil geomety"""
-    origin_upper = [x_port_up/c] + [y_port_up/c]
-    origin_lower = [x_port_low/c] + [y_port_low/c]
+    if geometry is None:
+        geometry = get_geometry(x_port_up, y_port_up, x_port_low, y_port_low)
+    origin_upper = [geometry.x_port_up/c] + [geometry.y_port_up/c]
+    origin_lower = [geometry.x_port_low/c] + [geometry.y_port_low/c]
 
-    x_points_up = np.hstack([0, x_port_up, 0.45])
-    x_points_low = np.hstack([0, x_port_low, 0.45])
-    y_points_up = np.hstack([0, y_port_up, 0.0])
-    y_points_low = np.hstack([0, y_port_low, 0.0])
+    """The pressure pushes along the inward normals"""
+    P_upper = -P_Dist_upper * geometry.normal_up.T
+    P_lower = -P_Dist_lower * geometry.normal_low.T
 
-    x_diff_up = np.gradient(x_points_up)[1:-1]
-    y_diff_up = np.gradient(y_points_up)[1:-1]
-    x_diff_low = np.gradient(x_points_low)[1:-1]
-    y_diff_low = np.gradient(y_points_low)[1:-1]
+    plot_airfoil(ax, geometry.x_points_up, geometry.x_points_low,
+                 geometry.y_points_up, geometry.y_points_low, c)
 
-    P_upper_y = -P_Dist_upper * np.sin(-np.arctan2(y_diff_up, x_diff_up))
-    P_upper_x = -P_Dist_upper * np.cos(-np.arctan2(y_diff_up, x_diff_up))
+    ax.quiver(*origin_upper, P_upper[0]/c, P_upper[1]/c)
+    ax.quiver(*origin_lower, P_lower[0]/c, P_lower[1]/c, pivot='tip')
+    ax.set_xlim(-0.1, 1.1)
 
-    P_lower_y = P_Dist_lower * np.sin(-np.arctan2(y_diff_low, x_diff_low))
-    P_lower_x = P_Dist_lower * np.cos(-np.arctan2(y_diff_low, x_diff_low))
 
-    plot_airfoil(ax, x_points_up, x_points_low, y_points_up, y_points_low, c)
+def get_geometry(x_port_up, y_port_up, x_port_low, y_port_low, chord=0.45):
+    """
+    Returns the AirfoilGeometry of the given taps. The
+    precomputed S826 geometry is reused when the tap
+    coordinates are those of airfoil_geometry.
+    """
+    ports = (x_port_up, y_port_up, x_port_low, y_port_low)
+    S826_ports = (S826.x_port_up, S826.y_port_up, S826.x_port_low, S826.y_port_low)
+    if chord == S826.chord and all(np.array_equal(port, S826_port)
+                                   for port, S826_port in zip(ports, S826_ports)):
+        return S826
+    return AirfoilGeometry(*ports, chord=chord)
+
+
+def integration_weights(x_port_up, y_port_up, x_port_low, y_port_low, chord=0.45):
+    """
+    Precomputes the geometry dependent part of the pressure
+    force integration, so that calc_coefficients only has to
+    do a matrix product for any number of Cp distributions.
+
+    Input:
+        x_port_up, y_port_up   : (ndarray, 1D) Coordinates of the
+                                 upper pressure taps [m]
+        x_port_low, y_port_low : (ndarray, 1D) Coordinates of the
+                                 lower pressure taps [m]
+        chord                  : (float) Chord length [m].
+                                 Default: 0.45
+    Output:
+        weights : (dict) 'upper' and 'lower' (ndarray, 2D) of
+                  shape (number of taps, 3) that map Cp of the
+                  taps to the contribution to C_n, C_a and the
+                  moment about the leading edge C_m_LE. Same as
+                  AirfoilGeometry.force_weights.
+    """
+    return get_geometry(x_port_up, y_port_up, x_port_low, y_port_low, chord).force_weights
+
+
+def calc_coefficients(Cp_upper, Cp_lower, alpha, weights, x_ref=0.25):
+    """
+    Integrates the pressure distributions to the force and
+    moment coefficients for any number of cases at once, e.g.
+    all angles of a polar or bootstrap resamples of them.
+
+    Input:
+        Cp_upper : (ndarray) Cp of the upper taps, the last
+                   axis is the tap, e.g. (n_alpha, n_taps).
+        Cp_lower : (ndarray) Cp of the lower taps, same
+                   leading shape as Cp_upper.
+        alpha    : (array_like) Angle of attack in degrees,
+                   broadcastable to the leading shape.
+        weights  : (dict or AirfoilGeometry) Output of
+                   integration_weights or a geometry.
+        x_ref    : (float) Moment reference point as a
+                   fraction of the chord. Default: 0.25
+    Output:
+        coeffs : (dict) 'C_l', 'C_d' (pressure drag), 'C_n',
+                 'C_a' and 'C_m' (positive nose up, about
+                 x_ref) with the leading shape of Cp_upper.
+    """
+    if isinstance(weights, AirfoilGeometry):
+        weights = weights.force_weights
+    C = np.matmul(Cp_upper, weights['upper']) + np.matmul(Cp_lower, weights['lower'])
+    C_n, C_a, C_m_LE = C[..., 0], C[..., 1], C[..., 2]
 
-    ax.quiver(*origin_upper, P_upper_y/c, P_upper_x/c)
-    ax.quiver(*origin_lower, P_lower_y/c, P_lower_x/c, pivot='tip')
-    ax.set_xlim(-0.1, 1.1)
+    """Using these to calculate the lift and (pressure) drag."""
+    alpha = np.deg2rad(alpha)
+    coeffs = OrderedDict()
+    coeffs['C_l'] = C_n * np.cos(alpha) - C_a * np.sin(alpha)
+    coeffs['C_d'] = C_n * np.sin(alpha) + C_a * np.cos(alpha)
+    coeffs['C_n'] = C_n
+    coeffs['C_a'] = C_a
+    coeffs['C_m'] = C_m_LE + x_ref * C_n
+    return coeffs
 
 
 def calc_cl(x_port_up, y_port_up, x_port_low, y_port_low, P_Dist_upper, P_Dist_lower):
     """Calculating resultant vector"""
     U_inf = 14.8
     chord = 0.45
-    alpha = 10 * np.pi / 180
+    alpha = 10
     fluid_properties = fluid_prop(29, 738)
     rho_air = fluid_properties[0]
     Cp_upper = P_Dist_upper / (0.5 * U_inf ** 2 * rho_air)
     Cp_lower = P_Dist_lower / (0.5 * U_inf ** 2 * rho_air)
 
-    """Could have calculated gradient/integral without endpoints, 
-        but this gives higher order at the ends"""
-    x_points_up = np.hstack([0, x_port_up, 0.45])
-    x_points_low = np.hstack([0, x_port_low, 0.45])
-    y_points_up = np.hstack([0, y_port_up, 0.0])
-    y_points_low = np.hstack([0, y_port_low, 0.0])
-
-    """Gradients are needed for the axial pressure coefficient"""
-    dydx_up = np.gradient(y_points_up, x_points_up)[1:-1]
-    dydx_low = np.gradient(y_points_low, x_points_low)[1:-1]
-
-    """Calculating the normal and axial integrated pressure forces using np.trapz to
-    numerically estimate the integrals"""
-    C_n = 1 / chord * (np.trapz(Cp_lower, x_port_low) - \
-                       np.trapz(Cp_upper, x_port_up))
-    C_a = 1 / chord * (np.trapz(Cp_upper * dydx_up, x_port_up) - \
-                       np.trapz(Cp_lower * dydx_low, x_port_low))
-
-    """Using these to calculate the lift and (pressure) drag."""
-    C_l = C_n * np.cos(alpha) - C_a * np.sin(alpha)
-    C_d = C_n * np.sin(alpha) + C_a * np.cos(alpha)
-
-    return C_l
+    """The normal and axial integrated pressure forces are the trapezoidal
+    integrals of Cp and Cp * dy/dx, see AirfoilGeometry.force_weights"""
+    geometry = get_geometry(x_port_up, y_port_up, x_port_low, y_port_low, chord)
+    return calc_coefficients(Cp_upper, Cp_lower, alpha, geometry)['C_l']
@@ -0,0 +1,205 @@
+###########################################################################
+# Opt-in profiling of the stages of the read / reduce / plot pipeline.
+#
+# The modules mark their hot paths with stage(name), a context manager
+# that records the wall clock time, the number of bytes and frames
+# handled and (optionally) the peak traced memory of the stage. Unless a
+# Profiler is active, stage returns a shared object that does nothing,
+# so the instrumentation costs one function call per stage.
+#
+# The stages are only recorded in the process where the Profiler is
+# active, so profile with processes=1 to include the worker stages.
+#
+# Usage:
+#     with Profiler(memory=True) as prof:
+#         results = sweep.run_sweep('raw_data/', 'Group13_370k', processes=1)
+#     prof.print_report()
+#     prof.write_report('profile.json')
+###########################################################################
+
+from collections import OrderedDict
+import json
+import time as timer
+import tracemalloc
+
+# The active Profiler, None when profiling is disabled
+_active = None
+
+
+class _NullStage:
+    """Stage that records nothing, used when profiling is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def add(self, nbytes=0, frames=0):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """One timed execution of a stage of an active Profiler."""
+
+    def __init__(self, profiler, name, nbytes, frames):
+        self.profiler = profiler
+        self.name = name
+        self.nbytes = nbytes
+        self.frames = frames
+        self.peak = 0
+
+    def add(self, nbytes=0, frames=0):
+        """Counts bytes and frames handled by the stage."""
+        self.nbytes += nbytes
+        self.frames += frames
+
+    def __enter__(self):
+        self.profiler._enter(self)
+        self.start = timer.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        seconds = timer.perf_counter() - self.start
+        self.profiler._exit(self, seconds)
+        return False
+
+
+def stage(name, nbytes=0, frames=0):
+    """
+    Context manager that records the stage name if a Profiler
+    is active. The bytes and frames handled by the stage are
+    given here or counted with the add(nbytes, frames) method
+    of the returned object.
+
+    Usage:
+        with profiling.stage('rpsb.read') as st:
+            frames = np.fromfile(fname, dtype=FRAME_DTYPE)
+            st.add(nbytes=frames.nbytes, frames=len(frames))
+    """
+    if _active is None:
+        return _NULL_STAGE
+    return _Stage(_active, name, nbytes, frames)
+
+
+def enabled():
+    """Returns True if a Profiler is active."""
+    return _active is not None
+
+
+class Profiler:
+    """
+    Collects the number of calls, the total wall clock time,
+    the bytes and frames handled and the peak memory of every
+    stage while it is active. The time of a stage includes
+    the time of the stages nested in it.
+
+    Input:
+        memory : (bool) Record the peak memory allocated in
+                 each stage with tracemalloc, which slows
+                 down the allocations. Default: False
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stages = OrderedDict()
+        self.wall_time = 0.0
+        self._stack = []
+        self._started_tracing = False
+
+    def start(self):
+        """Activates the profiler, replacing an active one."""
+        global _active
+        _active = self
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._tic = timer.perf_counter()
+
+    def stop(self):
+        """Deactivates the profiler."""
+        global _active
+        self.wall_time += timer.perf_counter() - self._tic
+        if _active is self:
+            _active = None
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _enter(self, st):
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak so far belongs to the enclosing stage
+            if self._stack:
+                self._stack[-1].peak = max(self._stack[-1].peak, peak)
+            st.base = current
+            tracemalloc.reset_peak()
+        self._stack.append(st)
+
+    def _exit(self, st, seconds):
+        self._stack.pop()
+        peak_bytes = 0
+        if self.memory:
+            peak = max(st.peak, tracemalloc.get_traced_memory()[1])
+            peak_bytes = peak - st.base
+            if self._stack:
+                self._stack[-1].peak = max(self._stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+
+        record = self.stages.get(st.name)
+        if record is None:
+            record = OrderedDict([('calls', 0), ('seconds', 0.0), ('bytes', 0),
+                                  ('frames', 0), ('peak_MB', 0.0)])
+            self.stages[st.name] = record
+        record['calls'] += 1
+        record['seconds'] += seconds
+        record['bytes'] += st.nbytes
+        record['frames'] += st.frames
+        record['peak_MB'] = max(record['peak_MB'], peak_bytes / 1024**2)
+
+    def report(self):
+        """
+        Returns the report (dict) with the 'wall_time' of the
+        run in seconds and the record of each stage, sorted by
+        the total time, with 'calls', 'seconds', 'bytes',
+        'frames', the throughput 'MB/s' and 'frames/s', and
+        'peak_MB' (0 unless memory is True).
+        """
+        stages = OrderedDict()
+        for name, record in sorted(self.stages.items(),
+                                   key=lambda item: -item[1]['seconds']):
+            record = OrderedDict(record)
+            seconds = record['seconds']
+            record['MB/s'] = record['bytes'] / 1024**2 / seconds if seconds > 0 else None
+            record['frames/s'] = record['frames'] / seconds if seconds > 0 else None
+            stages[name] = record
+        return OrderedDict([('wall_time', self.wall_time), ('stages', stages)])
+
+    def write_report(self, fname):
+        """Writes the report to the JSON file fname."""
+        with open(fname, 'w') as fp:
+            json.dump(self.report(), fp, indent=2)
+
+    def print_report(self):
+        """Prints the report as a table."""
+        report = self.report()
+        wall_time = report['wall_time']
+        print('{:<24s} {:>7s} {:>10s} {:>7s} {:>10s} {:>12s} {:>10s}'.format(
+            'stage', 'calls', 'seconds', '%wall', 'MB/s', 'frames/s', 'peak MB'))
+        for name, record in report['stages'].items():
+            share = 100 * record['seconds'] / wall_time if wall_time > 0 else 0
+            mb_per_s = record['MB/s'] if record['bytes'] else 0
+            frames_per_s = record['frames/s'] if record['frames'] else 0
+            print('{:<24s} {:>7d} {:>10.4f} {:>7.1f} {:>10.1f} {:>12.0f} {:>10.1f}'.format(
+                name, record['calls'], record['seconds'], share,
+                mb_per_s, frames_per_s, record['peak_MB']))
+        print('{:<24s} {:>7s} {:>10.4f}'.format('wall time', '', wall_time))
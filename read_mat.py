@@ -1,9 +1,150 @@
 from collections import OrderedDict
+from collections.abc import Mapping
 
 import h5py
 import numpy as np
 
-def read(fname, ofname=None):
+import profiling
+
+# Fields stored as Matlab char arrays
+STR_KEYS = ['Prefix', 'Re', 'savefilename']
+
+
+def _squeeze(tmp_data):
+    """
+    Squeezes row vectors (1, n) to 1D arrays and single
+    values to scalars, as Matlab stores both as 2D arrays.
+    """
+    if isinstance(tmp_data, (list, np.ndarray)):
+        # tmp_data = tmp_data.T
+        if len(tmp_data.shape) == 2 and tmp_data.shape[0] == 1:
+            tmp_data.shape = (tmp_data.shape[1],)
+        if len(tmp_data.shape) == 1 and tmp_data.shape[0] == 1:
+            tmp_data = tmp_data[0]
+    return tmp_data
+
+
+def _parse(key, tmp_data):
+    """
+    Converts Matlab indices and strings of the field key
+    to their Python counterpart.
+    """
+    if 'ind' in key:
+        # print('Assuming \'{:s}\' represents Matlab indices'.format(key))
+        ## Matlab is 1-indexed, Python is 0-indexed
+        tmp_data = (tmp_data - 1).astype(int)
+    if key in STR_KEYS:
+        char_arr = [chr(letter) for letter in np.asarray(tmp_data).flatten()]
+        tmp_data = ''.join(char_arr)
+    return tmp_data
+
+
+class MatFile(Mapping):
+    """
+    Read-only dictionary like access to the .mat file
+    (version 7.3 only) created by the Matlab script used
+    during the laboratory exercise in TEP4160.
+
+    The file is kept open and a field is only read from
+    the file the first time it is accessed. The same
+    conversions as in read(fname) are done on the field.
+    The method read(key, sel) reads only a part (hyperslab)
+    of a field, e.g. the row of one angle of attack.
+
+    Usage:
+        with MatFile(fname) as meta:
+            alphas = meta['alphas']
+            q_raw = meta.read('data_q_raw', np.s_[alpha_index, :])
+
+    Input:
+        fname  : (str) Path to the .mat file
+        fields : (list or None) Fields to expose. If None,
+                 all fields of the file are exposed.
+                 Default: None
+    """
+
+    def __init__(self, fname, fields=None):
+        self._h5f = h5py.File(fname, 'r')
+        keys = [key for key, group in self._h5f.items()
+                if not isinstance(group, h5py.Group)]
+        if fields is not None:
+            missing = [key for key in fields if key not in keys]
+            if missing:
+                self.close()
+                raise KeyError('Fields not found in {:s}: {:s}'.format(
+                    fname, ', '.join(missing)))
+            keys = [key for key in keys if key in fields]
+        self._keys = keys
+        self._cache = {}
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            if key not in self._keys:
+                raise KeyError(key)
+            with profiling.stage('read_mat.read') as st:
+                tmp_data = self._h5f[key][...]
+                st.add(nbytes=tmp_data.nbytes)
+                self._cache[key] = _parse(key, _squeeze(tmp_data))
+        return self._cache[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def read(self, key, sel=Ellipsis):
+        """
+        Reads the part sel of the field key from the file,
+        where sel indexes the field as returned by
+        self[key], e.g. a row vector is indexed as 1D.
+        String fields (STR_KEYS) can only be read whole.
+        """
+        if key not in self._keys:
+            raise KeyError(key)
+        if key in STR_KEYS:
+            if sel is not Ellipsis:
+                raise ValueError('{:s} is a string, only the whole field '
+                                 'can be read'.format(key))
+            return self[key]
+        if key in self._cache:
+            return self[key][sel]
+        dataset = self._h5f[key]
+        if not isinstance(sel, tuple):
+            sel = (sel,)
+        if len(dataset.shape) == 2 and dataset.shape[0] == 1:
+            sel = (0,) + sel
+        with profiling.stage('read_mat.read') as st:
+            tmp_data = dataset[sel]
+            st.add(nbytes=np.asarray(tmp_data).nbytes)
+            return _parse(key, tmp_data)
+
+    def shape(self, key):
+        """
+        Returns the shape of the field key as returned by
+        self[key], without reading it.
+        """
+        if key not in self._keys:
+            raise KeyError(key)
+        shape = self._h5f[key].shape
+        if len(shape) == 2 and shape[0] == 1:
+            shape = shape[1:]
+        if shape == (1,):
+            shape = ()
+        return shape
+
+    def close(self):
+        """Closes the file."""
+        self._h5f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read(fname, ofname=None, fields=None):
     """
     Read in the .mat file (version 7.3 only) created 
     by the Matlab script used during the laboratory 
@@ -25,37 +166,24 @@ def read(fname, ofname=None):
                  there is no save. NOTE: This will 
                  overwrite existing content in the file!
                  Default: None
+        fields : (list or None) Only read these fields,
+                 e.g. ['lower_ind', 'alphas']. If None,
+                 all fields are read. See also MatFile
+                 for reading fields on demand.
+                 Default: None
     Output:
-        data   : (dict) Dictionary containing all the 
+        data   : (dict) Dictionary containing all the
                  data fields in the .mat file
     """
-    
+
     data = OrderedDict()
-    with h5py.File(fname, 'r') as h5f:
-        for key, group in h5f.items():
-            if not isinstance(group, h5py.Group):
-                tmp_data = group[...]
-                if isinstance(tmp_data, (list, np.ndarray)):
-                    # tmp_data = tmp_data.T
-                    if len(tmp_data.shape) == 2 and tmp_data.shape[0] == 1:
-                        tmp_data.shape = (tmp_data.shape[1],)
-                    if len(tmp_data.shape) == 1 and tmp_data.shape[0] == 1:
-                        tmp_data = tmp_data[0]
-                if 'ind' in key:
-                    # print('Assuming \'{:s}\' represents Matlab indices'.format(key))
-                    ## Matlab is 1-indexed, Python is 0-indexed
-                    tmp_data = (tmp_data - 1).astype(int)
-                data[key] = tmp_data
-
-    # Parse strings to str
-    str_keys = ['Prefix', 'Re', 'savefilename']
-    for key in str_keys:
-        char_arr = [chr(letter) for letter in data[key].flatten()]
-        data[key] = ''.join(char_arr)
-  
+    with MatFile(fname, fields) as mat:
+        for key in mat:
+            data[key] = mat[key]
+
     if ofname is not None:
         with h5py.File(ofname, 'w') as h5f:
             for key, value in data.items():
                 h5f[key] = value
 
-    return data
\ No newline at end of file
+    return data
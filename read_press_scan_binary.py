@@ -1,9 +1,83 @@
 from collections import OrderedDict
 import io
+import os
+import warnings
 
 import numpy as np
 
-def read(fname):
+import profiling
+
+# Layout of one frame written by the MPS4264 pressure scanner.
+# Every frame is 87 little-endian 32-bit words (348 bytes).
+FRAME_WORDS = 87
+FRAME_BYTES = 4 * FRAME_WORDS
+FRAME_DTYPE = np.dtype([
+    ('packet_type', '<i4'),
+    ('packet_size', '<i4'),
+    ('frame_number', '<i4'),
+    ('scan_type', '<i4'),
+    ('frame_rate', '<f4'),
+    ('valve_status', '<i4'),
+    ('units_index', '<i4'),
+    ('unit_conversion_factor', '<f4'),
+    ('PTP_scan_start_time_sec', '<i4'),
+    ('PTP_scan_start_time_ns', '<i4'),
+    ('external_trigger_time', '<u4'),
+    ('temperatures', '<f4', (8,)),
+    ('pressures', '<f4', (64,)),
+    ('frame_time_sec', '<i4'),
+    ('frame_time_ns', '<i4'),
+    ('external_trigger_time_sec', '<i4'),
+    ('external_trigger_time_ns', '<i4'),
+])
+assert FRAME_DTYPE.itemsize == FRAME_BYTES
+# View of the words checked by validate_frames as two raw byte fields,
+# words 0-3 (packet_type, packet_size, frame_number, scan_type) and words
+# 83-84 (frame_time_sec, frame_time_ns), so that each is gathered from the
+# frames in a single pass
+_CHECK_DTYPE = np.dtype({'names': ['header', 'frame_time'],
+                         'formats': ['V16', 'V8'],
+                         'offsets': [0, 83 * 4], 'itemsize': FRAME_BYTES})
+
+
+class FrameWarning(UserWarning):
+    """Warning for dropped, duplicated or corrupt frames."""
+
+
+def _load_frames(fname, mmap=False):
+    """
+    Returns the complete frames of the file as a 1D 
+    structured array of FRAME_DTYPE. A trailing partial 
+    frame is ignored. If mmap is True the array is a 
+    read-only np.memmap of the file, otherwise the 
+    frames are read into memory in one go.
+    """
+    num_points = os.path.getsize(fname) // FRAME_BYTES
+    if num_points == 0:
+        return np.zeros(0, dtype=FRAME_DTYPE)
+    if mmap:
+        # The pages are only read when the frames are used, so no bytes
+        # or frames are credited to the mapping itself
+        with profiling.stage('rpsb.mmap'):
+            return np.memmap(fname, dtype=FRAME_DTYPE, mode='r', 
+                             shape=(num_points,))
+    with profiling.stage('rpsb.read', num_points * FRAME_BYTES, num_points):
+        return np.fromfile(fname, dtype=FRAME_DTYPE, count=num_points)
+
+
+def _frame_time(frames, t0=None):
+    """
+    Returns the time of each frame in seconds from the 
+    PTP scan start time of the first frame (or t0 if given).
+    """
+    if t0 is None:
+        t0 = frames['PTP_scan_start_time_sec'][0] \
+             + frames['PTP_scan_start_time_ns'][0] * 1e-9
+    return (t0 + frames['frame_time_sec'].astype(np.float64)) \
+           + frames['frame_time_ns'] * 1e-9
+
+
+def read(fname, mmap=False, validate=False):
     """
     Reads the binary file given by fname produced by the 
     MPS4264 pressure scanner. Returns the time of 
@@ -11,9 +85,20 @@ def read(fname):
     given in seconds from a given date, and should only
     be used to get the time delta between two measurements.
 
+    The file is decoded in a single vectorized pass, the
+    pressure is a strided view into the decoded frames.
+
     Input:
         fname : (str) Path to the file created by the 
                 pressure scanner.
+        mmap  : (bool) If True the file is memory-mapped 
+                and the pressure is a read-only view of the 
+                file on disk, i.e. nothing but the time is 
+                loaded until it is accessed. Default: False
+        validate : (bool) Check the integrity of the frames
+                   with validate_frames and warn with a
+                   FrameWarning if it finds any problem.
+                   Default: False
 
     Output:
         time     : (ndarray, 1D) Timestamp for all 
@@ -24,29 +109,26 @@ def read(fname):
                    second index is point in time.
     """
 
-    with io.open(fname, 'rb') as fp:
-        bin_data = fp.read()
-    
-    num_points = int(len(bin_data) / (4 * 87))
-    pressure = np.zeros((num_points, 64), dtype=np.float32)
-    time = np.zeros(num_points, dtype=np.float64)
-    t0_buff = np.frombuffer(bin_data, offset= 8 * 4, count=2, dtype='int32')
-    t0 = t0_buff[0] + t0_buff[1] * 1e-9
-    for ind in range(num_points):
-        start = (19 + 87 * ind) * 4
-        pressure[ind, :] = np.frombuffer(bin_data, offset=start, count=64, dtype='float32')
-        time_buff = np.frombuffer(bin_data, offset=start+256, count=2, dtype='int32')
-        time[ind] = t0 + time_buff[0] + time_buff[1] * 1e-9
+    frames = _load_frames(fname, mmap=mmap)
+    if validate:
+        _warn_invalid(fname, frames)
+    if len(frames) == 0:
+        return np.zeros(0), np.zeros((64, 0), dtype=np.float32)
+    time = _frame_time(frames)
+    pressure = frames['pressures']
 
     return time, pressure.T
 
 
-def read_full(fname):
+def read_full(fname, mmap=False, validate=False):
     """
     Reads the binary file given by fname produced by the 
     MPS4264 pressure scanner. Returns a dictionary with 
     all the information stored by the pressure scanner.
 
+    The frames are decoded in a single pass using 
+    FRAME_DTYPE, and every field is a view into them.
+
     NOTE: This function reads all the data in the same 
           format as created. Recommended to use the 
           read(fname) function if only pressure and 
@@ -55,83 +137,246 @@ def read_full(fname):
     Input:
         fname: (str) Path to the file created by the 
                pressure scanner.
+        mmap : (bool) If True the file is memory-mapped and
+               the fields are read-only views of the file 
+               on disk. Default: False
+        validate : (bool) Check the integrity of the frames
+               with validate_frames and warn with a
+               FrameWarning if it finds any problem.
+               Default: False
 
     Output:
         data: (dict) Dictionary of all the data stored
               in the file in native precision. 
     """
-    with io.open(fname, 'rb') as fp:
-        bin_data = fp.read()
-    
-    num_points = int(len(bin_data) / (4 * 87))
-    # Create storage
+    frames = _load_frames(fname, mmap=mmap)
+    if validate:
+        _warn_invalid(fname, frames)
+
     data = OrderedDict()
-    data['packet_type'] = np.zeros(num_points, dtype=np.int32)
-    data['packet_size'] = np.zeros(num_points, dtype=np.int32)
-    data['frame_number'] = np.zeros(num_points, dtype=np.int32)
-    data['scan_type'] = np.zeros(num_points, dtype=np.int32)
-    data['frame_rate'] = np.zeros(num_points, dtype=np.float32)
-    data['valve_status'] = np.zeros(num_points, dtype=np.int32)
-    data['units_index'] = np.zeros(num_points, dtype=np.int32)
-    data['unit_conversion_factor'] = np.zeros(num_points, dtype=np.float32)
-    data['PTP_scan_start_time_sec'] = np.zeros(num_points, dtype=np.int32)
-    data['PTP_scan_start_time_ns'] = np.zeros(num_points, dtype=np.int32)
-    data['external_trigger_time'] = np.zeros(num_points, dtype=np.uint32)
-    data['temperatures'] = np.zeros((num_points, 8), dtype=np.float32)
-    data['pressures'] = np.zeros((num_points, 64), dtype=np.float32)
-    data['frame_time_sec'] = np.zeros(num_points, dtype=np.int32)
-    data['frame_time_ns'] = np.zeros(num_points, dtype=np.int32)
-    data['external_trigger_time_sec'] = np.zeros(num_points, dtype=np.int32)
-    data['external_trigger_time_ns'] = np.zeros(num_points, dtype=np.int32)
-
-    # Parse the binary data
-    pos = 0
-    for ind in range(num_points):
-        buff = np.frombuffer(bin_data, offset=pos, count=4, dtype='int32')
-        pos += 16
-        data['packet_type'][ind] = buff[0]
-        data['packet_size'][ind] = buff[1]
-        data['frame_number'][ind] = buff[2]
-        data['scan_type'][ind] = buff[3]
-        
-        data['frame_rate'][ind] = np.frombuffer(bin_data, offset=pos, 
-                                                count=1, dtype='float32')
-        pos += 4
-
-        buff = np.frombuffer(bin_data, offset=pos, count=2, dtype='int32')
-        pos += 8
-        data['valve_status'][ind] = buff[0]
-        data['units_index'][ind] = buff[1]
-
-        data['unit_conversion_factor'][ind] = np.frombuffer(bin_data, offset=pos, 
-                                                            count=1, dtype='float32')
-        pos += 4
-
-        buff = np.frombuffer(bin_data, offset=pos, count=2, dtype='int32')
-        pos += 8
-        data['PTP_scan_start_time_sec'][ind] = buff[0]
-        data['PTP_scan_start_time_ns'][ind] = buff[1]
-
-        data['external_trigger_time'][ind] = np.frombuffer(bin_data, offset=pos, 
-                                                           count=1, dtype='uint32')
-        pos += 1
-
-        data['temperatures'][ind, :] = np.frombuffer(bin_data, offset=pos, 
-                                                     count=8, dtype='float32')
-        pos += 32
-
-        data['pressures'][ind, :] = np.frombuffer(bin_data, offset=pos, 
-                                                  count=64, dtype='float32')
-        pos += 256
-
-        buff = np.frombuffer(bin_data, offset=pos, count=4, dtype='int32')
-        pos += 16
-        data['frame_time_sec'][ind] = buff[0]
-        data['frame_time_ns'][ind] = buff[1]
-        data['external_trigger_time_sec'][ind] = buff[2]
-        data['external_trigger_time_ns'][ind] = buff[3]
-    
+    for key in FRAME_DTYPE.names:
+        data[key] = frames[key]
+
     data['temperatures'] = data['temperatures'].T
     data['pressures'] = data['pressures'].T
 
-    return data
\ No newline at end of file
+    return data
+
+
+def write_full(fname, data):
+    """
+    Writes a dictionary on the form returned by read_full 
+    to a binary file in the MPS4264 format. Fields missing
+    from data are written as zeros.
+
+    Input:
+        fname: (str) Path to the output file. NOTE: This 
+               will overwrite an existing file!
+        data : (dict) Dictionary with the fields of 
+               FRAME_DTYPE, temperatures and pressures
+               with the port as the first index.
+    """
+    num_points = len(data['pressures'][0])
+    frames = np.zeros(num_points, dtype=FRAME_DTYPE)
+    for key, value in data.items():
+        if key in ('temperatures', 'pressures'):
+            value = np.asarray(value).T
+        frames[key] = value
+
+    frames.tofile(fname)
+
+
+def iter_frames(fname, chunk_frames=100000, start=0, stop=None):
+    """
+    Iterates over the binary file given by fname produced 
+    by the MPS4264 pressure scanner in blocks of at most
+    chunk_frames frames, so that files larger than the
+    available memory can be processed. The blocks are on 
+    the same form as the output of read(fname).
+
+    Input:
+        fname        : (str) Path to the file created by 
+                       the pressure scanner.
+        chunk_frames : (int) Maximum number of frames in 
+                       each block. Default: 100000
+        start        : (int) First frame to read. Default: 0
+        stop         : (int or None) Stop before this frame.
+                       Default: None (end of file)
+
+    Output (yield):
+        time     : (ndarray, 1D) Timestamp for the frames 
+                   in the block.
+        pressure : (ndarray, 2D) Pressure value for all 
+                   ports in the block. First index is the 
+                   pressure port, second index is point 
+                   in time.
+    """
+    num_points = os.path.getsize(fname) // FRAME_BYTES
+    if stop is None or stop > num_points:
+        stop = num_points
+    if start >= stop:
+        return
+    with io.open(fname, 'rb') as fp:
+        # The time is relative to the scan start time of the first frame
+        head = np.fromfile(fp, dtype=FRAME_DTYPE, count=1)
+        t0 = head['PTP_scan_start_time_sec'][0] \
+             + head['PTP_scan_start_time_ns'][0] * 1e-9
+        fp.seek(start * FRAME_BYTES)
+        for first in range(start, stop, chunk_frames):
+            count = min(chunk_frames, stop - first)
+            with profiling.stage('rpsb.read', count * FRAME_BYTES, count):
+                frames = np.fromfile(fp, dtype=FRAME_DTYPE, count=count)
+            yield _frame_time(frames, t0), frames['pressures'].T
+
+
+def validate_frames(frames, trailing_bytes=0, packet_type=None,
+                    packet_size=None, jitter_tol=0.25):
+    """
+    Checks the integrity of decoded frames with array
+    operations only: the packet headers, the continuity of
+    the frame numbers and the spacing of the frame times.
+
+    Input:
+        frames         : (ndarray, 1D) Frames of FRAME_DTYPE, e.g.
+                         from np.fromfile or np.memmap.
+        trailing_bytes : (int) Bytes of a partial frame at the
+                         end of the file. Default: 0
+        packet_type    : (int or None) Expected packet_type. If
+                         None, the most common value. Default: None
+        packet_size    : (int or None) Expected packet_size. If
+                         None, the most common value.
+                         Default: None
+        jitter_tol     : (float) A frame interval is irregular if it
+                         deviates from the nominal interval by more
+                         than this fraction of the frame period.
+                         Default: 0.25
+
+    Output:
+        valid  : (ndarray, 1D) True for the frames that have the
+                 expected header, a frame number larger than the
+                 frame before and a valid frame time.
+        report : (dict) 'num_frames', 'trailing_bytes',
+                 'truncated', 'bad_header' (number of frames),
+                 'dropped' (missing frame numbers), 'gaps' (number
+                 of places with missing frames), 'duplicates',
+                 'out_of_order', 'bad_time' (frame_time_ns outside
+                 [0, 1e9)), 'frame_rate' (nominal) and
+                 'measured_frame_rate' [Hz], 'jitter_std',
+                 'jitter_max' [s] of the frame intervals from the
+                 nominal period, 'irregular' (number of intervals
+                 beyond jitter_tol), and 'ok' (True if no problem
+                 was found).
+    """
+    num_frames = len(frames)
+    report = OrderedDict()
+    report['num_frames'] = num_frames
+    report['trailing_bytes'] = int(trailing_bytes)
+    report['truncated'] = trailing_bytes > 0
+    valid = np.ones(num_frames, dtype=bool)
+    view = frames.view(_CHECK_DTYPE)
+    header = np.ascontiguousarray(view['header']).view('<i4').reshape(-1, 4)
+
+    # Packet headers, compared to the first frame unless given, with
+    # packet_type and packet_size as one 64-bit word
+    expected = [packet_type, packet_size]
+    if num_frames:
+        for ind in range(2):
+            if expected[ind] is None:
+                expected[ind] = header[0, ind]
+        bad_header = header.view('<i8')[:, 0] != np.array(expected, dtype='<i4').view('<i8')[0]
+        if np.any(bad_header) and (packet_type is None or packet_size is None):
+            # Use the most common values instead of those of the first frame
+            bad_header[:] = False
+            for ind, value in enumerate((packet_type, packet_size)):
+                values = header[:, ind]
+                if value is None:
+                    unique, counts = np.unique(values, return_counts=True)
+                    value = unique[np.argmax(counts)]
+                bad_header |= values != value
+        valid &= ~bad_header
+        report['bad_header'] = int(np.count_nonzero(bad_header))
+    else:
+        report['bad_header'] = 0
+
+    # Continuity of the frame numbers, the details are only worked out
+    # for the few steps that are not 1
+    step = np.diff(header[:, 2])
+    jump = step != 1
+    steps = step[jump].astype(np.int64)
+    report['dropped'] = int(np.sum(steps[steps > 1] - 1))
+    report['gaps'] = int(np.count_nonzero(steps > 1))
+    report['duplicates'] = int(np.count_nonzero(steps == 0))
+    report['out_of_order'] = int(np.count_nonzero(steps < 0))
+    if len(steps):
+        valid[1:] &= step > 0
+
+    # Seconds and nanoseconds of the frame times, from one contiguous copy
+    frame_time = np.ascontiguousarray(view['frame_time']).view('<i4').reshape(-1, 2)
+    time_sec, time_ns = frame_time[:, 0], frame_time[:, 1]
+    # Nanoseconds outside [0, 1e9), negative values are large as unsigned
+    bad_time = time_ns.view('<u4') >= 1000000000
+    valid &= ~bad_time
+    report['bad_time'] = int(np.count_nonzero(bad_time))
+
+    frame_rate = float(frames['frame_rate'][0]) if num_frames else np.nan
+    report['frame_rate'] = frame_rate
+    report['measured_frame_rate'] = np.nan
+    report['jitter_std'] = np.nan
+    report['jitter_max'] = np.nan
+    report['irregular'] = 0
+    if num_frames > 1 and frame_rate > 0:
+        period_ns = 1e9 / frame_rate
+        # Interval between the frames in nanoseconds
+        interval = np.diff(time_sec).astype(np.float64)
+        interval *= 1e9
+        interval += np.diff(time_ns)
+        # Only the intervals between consecutive valid frames are compared
+        if not np.all(valid):
+            pair = valid[1:] & valid[:-1]
+            interval = interval[pair]
+            step = step[pair]
+            jump = jump[pair]
+        if len(interval):
+            num_periods = step.sum(dtype=np.int64)
+            report['measured_frame_rate'] = float(num_periods * 1e9 / interval.sum())
+            if np.any(jump):
+                jitter = interval - step * period_ns
+            else:
+                jitter = interval - period_ns
+            report['jitter_std'] = float(jitter.std() * 1e-9)
+            jitter_max = max(jitter.max(), -jitter.min())
+            report['jitter_max'] = float(jitter_max * 1e-9)
+            # The irregular intervals are only counted if there are any
+            tol = jitter_tol * period_ns
+            if jitter_max > tol:
+                report['irregular'] = int(np.count_nonzero(np.abs(jitter) > tol))
+
+    report['ok'] = not (report['truncated'] or report['bad_header'] or report['dropped']
+                        or report['duplicates'] or report['out_of_order']
+                        or report['bad_time'] or report['irregular'])
+    return valid, report
+
+
+def check_file(fname, mmap=True, **kwargs):
+    """
+    Decodes the binary file given by fname and checks the
+    integrity of its frames, see validate_frames for the
+    keyword arguments and the output. The file is memory-
+    mapped by default, so only the checked fields are read.
+    """
+    frames = _load_frames(fname, mmap=mmap)
+    trailing_bytes = os.path.getsize(fname) % FRAME_BYTES
+    return validate_frames(frames, trailing_bytes, **kwargs)
+
+
+def _warn_invalid(fname, frames):
+    """Warns with a FrameWarning if the frames of fname are not valid."""
+    trailing_bytes = os.path.getsize(fname) % FRAME_BYTES
+    _, report = validate_frames(frames, trailing_bytes)
+    if not report['ok']:
+        problems = ['{:s}={}'.format(key, report[key])
+                    for key in ('trailing_bytes', 'bad_header', 'dropped', 'duplicates',
+                                'out_of_order', 'bad_time', 'irregular')
+                    if report[key]]
+        warnings.warn('{:s}: {:s}'.format(fname, ', '.join(problems)),
+                      FrameWarning, stacklevel=3)
@@ -0,0 +1,179 @@
+###########################################################################
+# Headless rendering of the pressure distributions of many cases.
+#
+# The figures are drawn on the Agg canvas without pyplot, so no display
+# is needed. One figure template (the -Cp distribution and the pressure
+# vectors on the airfoil, as in example_script) is created per worker
+# process and only the data of the lines and arrows is updated for each
+# case before it is saved.
+#
+# Usage:
+#     results = sweep.run_sweep('raw_data/', 'Group13_370k')
+#     timing = render_sweep(results, 'figures/', 'Group13_370k')
+###########################################################################
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time as timer
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
+
+from airfoil_geometry import S826
+import profiling
+
+
+class CaseRenderer:
+    """
+    Figure template with the -Cp distribution (top) and
+    the pressure vectors on the airfoil (bottom) that is
+    redrawn for each case.
+
+    Input:
+        x_upper, x_lower : (ndarray, 1D) x/c of the upper and
+                           lower taps for the Cp distribution.
+        geometry         : (AirfoilGeometry) Geometry for the
+                           pressure vectors. Default: S826
+        vector_scale     : (float) Cp per unit length of the
+                           pressure vectors in x/c. Default: 10
+        dpi              : (int) Resolution of the saved figures.
+                           Default: 150
+    """
+
+    def __init__(self, x_upper, x_lower, geometry=S826, vector_scale=10.0, dpi=150):
+        self.geometry = geometry
+        self.dpi = dpi
+        self.fig = Figure(dpi=dpi)
+        FigureCanvasAgg(self.fig)
+        ax, ax2 = self.fig.subplots(2, 1, sharex=True)
+        self.ax, self.ax2 = ax, ax2
+
+        for axis in (ax, ax2):
+            axis.axvline(x=0, color='gray')
+            axis.axvline(x=1, color='gray')
+        nan_up = np.full(len(x_upper), np.nan)
+        nan_low = np.full(len(x_lower), np.nan)
+        self.line_upper, = ax.plot(x_upper, nan_up, '-ob', label=r'Upper surface',
+                                   linewidth=1, markersize=4)
+        self.line_lower, = ax.plot(x_lower, nan_low, '-or', label=r'Lower surface',
+                                   linewidth=1, markersize=4)
+        ax.legend(loc='best')
+        ax.set_xlabel(r'$x/c$', fontsize=16)
+        ax.set_ylabel(r'$-Cp$', fontsize=16)
+        ax.set_xlim((0, 1))
+        self.title = ax.set_title('', fontsize=16)
+
+        c = geometry.chord
+        ax2.plot(geometry.x_points_low/c, geometry.y_points_low/c, linewidth=2, color='k')
+        ax2.plot(geometry.x_points_up/c, geometry.y_points_up/c, linewidth=2, color='k')
+        ax2.axis('equal')
+        zeros_up = np.zeros(len(geometry.x_port_up))
+        zeros_low = np.zeros(len(geometry.x_port_low))
+        self.quiver_upper = ax2.quiver(geometry.x_port_up/c, geometry.y_port_up/c,
+                                       zeros_up, zeros_up, angles='xy',
+                                       scale_units='xy', scale=vector_scale)
+        self.quiver_lower = ax2.quiver(geometry.x_port_low/c, geometry.y_port_low/c,
+                                       zeros_low, zeros_low, angles='xy',
+                                       scale_units='xy', scale=vector_scale,
+                                       pivot='tip')
+        ax2.set_xlim(-0.1, 1.1)
+
+    def update(self, alpha, Cp_upper, Cp_lower):
+        """Updates the figure with the Cp distribution of one case."""
+        self.line_upper.set_ydata(-Cp_upper)
+        self.line_lower.set_ydata(-Cp_lower)
+        self.ax.relim()
+        self.ax.autoscale_view(scalex=False)
+        self.title.set_text('$\\alpha= %s ^{\\circ}$' % alpha)
+
+        # The pressure pushes along the inward normals
+        vectors_upper = -Cp_upper * self.geometry.normal_up.T
+        vectors_lower = -Cp_lower * self.geometry.normal_low.T
+        self.quiver_upper.set_UVC(*vectors_upper)
+        self.quiver_lower.set_UVC(*vectors_lower)
+
+    def save(self, fname):
+        """Saves the figure, the format is given by the extension."""
+        self.fig.savefig(fname, dpi=self.dpi)
+
+
+def _render_cases(cases, x_upper, x_lower, vector_scale, dpi):
+    """
+    Renders a list of cases (alpha, Cp_upper, Cp_lower,
+    file names) with one figure template. Returns the
+    time spent on the setup, the updates and the saving.
+    """
+    timing = OrderedDict([('setup', 0.0), ('update', 0.0), ('save', 0.0)])
+    tic = timer.perf_counter()
+    with profiling.stage('matplotlib'):
+        renderer = CaseRenderer(x_upper, x_lower, vector_scale=vector_scale, dpi=dpi)
+    timing['setup'] = timer.perf_counter() - tic
+    for alpha, Cp_upper, Cp_lower, fnames in cases:
+        tic = timer.perf_counter()
+        with profiling.stage('matplotlib'):
+            renderer.update(alpha, Cp_upper, Cp_lower)
+        timing['update'] += timer.perf_counter() - tic
+        tic = timer.perf_counter()
+        for fname in fnames:
+            with profiling.stage('matplotlib.save'):
+                renderer.save(fname)
+        timing['save'] += timer.perf_counter() - tic
+    return timing
+
+
+def render_sweep(results, directory, prefix='case', formats=('png',),
+                 processes=None, vector_scale=10.0, dpi=150):
+    """
+    Renders the pressure distribution of every angle in the
+    results of sweep.reduce_sweep to files in directory,
+    named '<prefix>_a<alpha>.<format>'.
+
+    Input:
+        results      : (dict) Output of sweep.reduce_sweep.
+        directory    : (str) Output directory, created if it
+                       does not exist.
+        prefix       : (str) Prefix of the file names.
+                       Default: 'case'
+        formats      : (tuple) File formats, e.g. ('png', 'pdf').
+                       Default: ('png',)
+        processes    : (int or None) Number of worker processes,
+                       1 renders in this process. Default: None
+                       (number of cores)
+        vector_scale : (float) Cp per unit length of the pressure
+                       vectors in x/c. Default: 10
+        dpi          : (int) Resolution. Default: 150
+
+    Output:
+        timing : (dict) Wall clock time in seconds of the 'setup'
+                 of the templates, the 'update' of the data and
+                 the 'save' of the files summed over the workers,
+                 the 'total' elapsed time and the number of 'cases'.
+    """
+    tic = timer.perf_counter()
+    os.makedirs(directory, exist_ok=True)
+    cases = []
+    for ind, alpha in enumerate(results['alpha']):
+        fnames = [os.path.join(directory, '{:s}_a{:d}.{:s}'.format(prefix, int(alpha), fmt))
+                  for fmt in formats]
+        cases.append((alpha, results['Cp_upper'][ind], results['Cp_lower'][ind], fnames))
+
+    if processes is None:
+        processes = os.cpu_count()
+    processes = max(1, min(processes, len(cases)))
+    chunks = [cases[ind::processes] for ind in range(processes)]
+    args = (results['x_upper'], results['x_lower'], vector_scale, dpi)
+    if processes == 1:
+        timings = [_render_cases(chunks[0], *args)]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(_render_cases, chunk, *args) for chunk in chunks]
+            timings = [future.result() for future in futures]
+
+    timing = OrderedDict()
+    for key in ('setup', 'update', 'save'):
+        timing[key] = sum(part[key] for part in timings)
+    timing['total'] = timer.perf_counter() - tic
+    timing['cases'] = len(cases)
+    return timing
@@ -0,0 +1,216 @@
+###########################################################################
+# Columnar store of the reduced results of many datasets.
+#
+# One row per angle of attack of a dataset, with the flow properties,
+# the force coefficients and the Cp of every tap, stored in chunked and
+# compressed HDF5 datasets (one per column). The group, Reynolds number
+# label and angle of every row are kept in memory as an index, so
+# queries only read the rows they return and never the raw data.
+#
+# Usage:
+#     with ResultsStore('results.h5') as store:
+#         store.append(sweep.run_sweep('raw_data/', 'Group13_370k'),
+#                      'Group13_370k')
+#         polar = store.query(Re='370k', fields=['alpha', 'C_l'])
+###########################################################################
+
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+
+# Columns with one value per row
+SCALAR_COLUMNS = ['alpha', 'q_inf', 'T_inf', 'P_atm', 'rho', 'mu', 'U_inf',
+                  'Re_c', 'C_l', 'C_d', 'C_n', 'C_a', 'C_m']
+# Columns with one value per tap and row
+TAP_COLUMNS = ['Cp_upper', 'Cp_lower']
+# Index columns
+INDEX_COLUMNS = ['group', 'Re']
+CHUNK_ROWS = 256
+
+
+def _read_rows(dataset, rows):
+    """
+    Reads the rows (ndarray of int, 1D) of the HDF5 dataset,
+    one slice per run of consecutive rows, so that only the
+    chunks holding them are decompressed.
+    """
+    order = np.argsort(rows, kind='stable')
+    sorted_rows = rows[order]
+    starts = np.flatnonzero(np.diff(sorted_rows, prepend=-2) != 1)
+    ends = np.append(starts[1:], len(sorted_rows))
+    values = np.concatenate([dataset[sorted_rows[start]:sorted_rows[end - 1] + 1]
+                             for start, end in zip(starts, ends)])
+    # Back to the order of rows
+    out = np.empty_like(values)
+    out[order] = values
+    return out
+
+
+class ResultsStore:
+    """
+    Append-only HDF5 store of sweep results, indexed by the
+    group, the Reynolds number label and the angle of attack.
+
+    Input:
+        fname : (str) Path to the HDF5 file, created if it does
+                not exist.
+        mode  : (str) 'a' to read and append or 'r' to only read.
+                Default: 'a'
+    """
+
+    def __init__(self, fname, mode='a'):
+        self._h5f = h5py.File(fname, mode)
+        self._load_index()
+
+    def _load_index(self):
+        if 'group' in self._h5f:
+            self._group = self._h5f['group'][...].astype(str)
+            self._Re = self._h5f['Re'][...].astype(str)
+            self._alpha = self._h5f['alpha'][...]
+        else:
+            self._group = np.zeros(0, dtype=str)
+            self._Re = np.zeros(0, dtype=str)
+            self._alpha = np.zeros(0)
+
+    def __len__(self):
+        return len(self._alpha)
+
+    @property
+    def groups(self):
+        """Names of the groups in the store."""
+        return sorted(set(self._group.tolist()))
+
+    @property
+    def reynolds(self):
+        """Reynolds number labels in the store."""
+        return sorted(set(self._Re.tolist()))
+
+    def _create(self, results):
+        num_up = results['Cp_upper'].shape[1]
+        num_low = results['Cp_lower'].shape[1]
+        options = dict(compression='gzip', shuffle=True)
+        for key in INDEX_COLUMNS:
+            self._h5f.create_dataset(key, shape=(0,), dtype='S64',
+                                     chunks=(CHUNK_ROWS,), maxshape=(None,), **options)
+        for key in SCALAR_COLUMNS:
+            self._h5f.create_dataset(key, shape=(0,), dtype=np.float64,
+                                     chunks=(CHUNK_ROWS,), maxshape=(None,), **options)
+        for key, num_taps in zip(TAP_COLUMNS, (num_up, num_low)):
+            self._h5f.create_dataset(key, shape=(0, num_taps), dtype=np.float64,
+                                     chunks=(CHUNK_ROWS, num_taps),
+                                     maxshape=(None, num_taps), **options)
+        self._h5f['x_upper'] = results['x_upper']
+        self._h5f['x_lower'] = results['x_lower']
+
+    def append(self, results, group, Re=None, overwrite=False):
+        """
+        Adds the rows of the results of a sweep.
+
+        Input:
+            results   : (dict) Output of sweep.reduce_sweep.
+            group     : (str) Name of the dataset, e.g. the
+                        group_name_prefix 'Group13_370k'.
+            Re        : (str or None) Reynolds number label. If
+                        None, the part of group after the last
+                        '_'. Default: None
+            overwrite : (bool) Replace rows with the same group
+                        and angle instead of raising ValueError.
+                        Default: False
+        """
+        if Re is None:
+            Re = group.split('_')[-1]
+        if 'group' not in self._h5f:
+            self._create(results)
+
+        alphas = np.asarray(results['alpha'], dtype=np.float64)
+        existing = np.flatnonzero(self._group == group)
+        row_of_alpha = dict(zip(self._alpha[existing], existing))
+        rows = np.array([row_of_alpha.get(alpha, -1) for alpha in alphas], dtype=int)
+        if not overwrite and np.any(rows >= 0):
+            raise ValueError('{:s} already has rows for alpha = {}'.format(
+                group, alphas[rows >= 0].tolist()))
+
+        # Update rows that exist, append the rest
+        new = rows < 0
+        num_rows = len(self)
+        rows[new] = num_rows + np.arange(np.count_nonzero(new))
+        columns = OrderedDict()
+        columns['group'] = np.full(len(alphas), group.encode(), dtype='S64')
+        columns['Re'] = np.full(len(alphas), Re.encode(), dtype='S64')
+        for key in SCALAR_COLUMNS + TAP_COLUMNS:
+            columns[key] = np.asarray(results[key], dtype=np.float64)
+        for key, values in columns.items():
+            dataset = self._h5f[key]
+            dataset.resize(num_rows + np.count_nonzero(new), axis=0)
+            dataset[num_rows:] = values[new]
+            for ind in np.flatnonzero(~new):
+                dataset[rows[ind]] = values[ind]
+        self._h5f.flush()
+        self._load_index()
+
+    def select(self, group=None, Re=None, alpha=None):
+        """
+        Returns the rows (ndarray, 1D) matching the query,
+        sorted by group and angle. Every argument can be a
+        single value, a list of values or None for all.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for values, column in ((group, self._group), (Re, self._Re),
+                               (alpha, self._alpha)):
+            if values is not None:
+                mask &= np.isin(column, np.atleast_1d(values))
+        rows = np.flatnonzero(mask)
+        order = np.lexsort((self._alpha[rows], self._group[rows]))
+        return rows[order]
+
+    def query(self, group=None, Re=None, alpha=None, fields=None):
+        """
+        Reads the rows matching the query, e.g. the polar of
+        one group or all groups at one Reynolds number.
+
+        Input:
+            group  : (str, list or None) Groups. Default: None (all)
+            Re     : (str, list or None) Reynolds number labels.
+                     Default: None (all)
+            alpha  : (float, list or None) Angles of attack.
+                     Default: None (all)
+            fields : (list or None) Columns to read. Default: None
+                     (all)
+        Output:
+            data : (dict) One array per column, rows sorted by
+                   group and angle.
+        """
+        rows = self.select(group, Re, alpha)
+        if fields is None:
+            fields = INDEX_COLUMNS + SCALAR_COLUMNS + TAP_COLUMNS
+        data = OrderedDict()
+        if len(rows) == 0:
+            for key in fields:
+                data[key] = np.zeros(0)
+            return data
+
+        for key in fields:
+            if key == 'group':
+                data[key] = self._group[rows]
+            elif key == 'Re':
+                data[key] = self._Re[rows]
+            elif key == 'alpha':
+                data[key] = self._alpha[rows]
+            else:
+                data[key] = _read_rows(self._h5f[key], rows)
+        return data
+
+    def polar(self, group, fields=('alpha', 'C_l', 'C_d', 'C_m', 'Re_c')):
+        """Returns the given columns of one group sorted by angle."""
+        return self.query(group=group, fields=list(fields))
+
+    def close(self):
+        """Closes the file."""
+        self._h5f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,335 @@
+###########################################################################
+# Lossless archival format for the pressure scanner files.
+#
+# A capture is repacked into a chunked and compressed HDF5 file with one
+# dataset per field of the frames (time as the first index):
+#   - fields that are the same in every frame (packet_type, frame_rate,
+#     units_index, ...) are stored once, as attributes of /frames,
+#   - pressures and temperatures are kept as float32,
+#   - the second and nanosecond words of a timestamp are stored as one
+#     int64 count of nanoseconds in /time_ns,
+#   - the frame numbers and timestamps are delta coded within each chunk,
+#     optionally the pressures and temperatures as well.
+# The bits of every frame, and a trailing partial frame, are restored
+# exactly by to_binary, and read/read_full are drop-ins for those of
+# read_press_scan_binary that only decompress the requested frames.
+#
+# Usage:
+#     convert('raw_data/Group13_370k_a10.dat', 'archive/Group13_370k_a10.h5')
+#     time, pressure = read('archive/Group13_370k_a10.h5', start=0, stop=5000)
+###########################################################################
+
+from collections import OrderedDict
+import os
+
+import h5py
+import numpy as np
+
+import read_press_scan_binary as rpsb
+
+# Fields with one value per port
+ARRAY_FIELDS = ['temperatures', 'pressures']
+# Timestamps stored as seconds and nanoseconds
+TIME_FIELDS = ['PTP_scan_start_time', 'frame_time', 'external_trigger_time']
+# Integer fields that are delta coded
+DELTA_FIELDS = ['frame_number']
+FORMAT_VERSION = 1
+
+
+def _as_bits(values):
+    """Unsigned integer view of values, so that NaNs compare by bits."""
+    return values.view('<u{:d}'.format(values.dtype.itemsize))
+
+
+def _delta_encode(values, chunk_frames):
+    """
+    Differences of the bits of values (first index is time)
+    within each chunk of chunk_frames rows, the first row of
+    every chunk is kept. values must start at a chunk.
+    """
+    bits = _as_bits(np.ascontiguousarray(values))
+    encoded = bits.copy()
+    encoded[1:] -= bits[:-1]
+    encoded[::chunk_frames] = bits[::chunk_frames]
+    return encoded.view(values.dtype)
+
+
+def _delta_decode(encoded, chunk_frames):
+    """Inverse of _delta_encode."""
+    bits = _as_bits(np.ascontiguousarray(encoded))
+    decoded = np.empty_like(bits)
+    # Sum all the complete chunks in one call, then the last one
+    num_full = len(bits) - len(bits) % chunk_frames
+    shape = (-1, chunk_frames) + bits.shape[1:]
+    np.cumsum(bits[:num_full].reshape(shape), axis=1, dtype=bits.dtype,
+              out=decoded[:num_full].reshape(shape))
+    np.cumsum(bits[num_full:], axis=0, dtype=bits.dtype, out=decoded[num_full:])
+    return decoded.view(encoded.dtype)
+
+
+def _scan_layout(fname, block_frames):
+    """
+    Finds the fields that are constant over the frames of
+    fname and the timestamps whose nanoseconds are all in
+    [0, 1e9), in one pass over the memory-mapped file.
+    """
+    frames = rpsb._load_frames(fname, mmap=True)
+    if len(frames) == 0:
+        return {}, set()
+    first = frames[0]
+    constant = {key for key in rpsb.FRAME_DTYPE.names if key not in ARRAY_FIELDS}
+    combinable = set(TIME_FIELDS)
+    for start in range(0, len(frames), block_frames):
+        block = frames[start:start + block_frames]
+        for key in list(constant):
+            if np.any(_as_bits(block[key]) != _as_bits(first[key][None])):
+                constant.discard(key)
+        for prefix in list(combinable):
+            time_ns = block[prefix + '_ns']
+            if np.any((time_ns < 0) | (time_ns >= 1000000000)):
+                combinable.discard(prefix)
+    constants = OrderedDict((key, first[key].copy()) for key in rpsb.FRAME_DTYPE.names
+                            if key in constant)
+    # A timestamp is combined unless both of its words are constant
+    combined = {prefix for prefix in combinable
+                if not (prefix + '_sec' in constants and prefix + '_ns' in constants)}
+    for prefix in combined:
+        constants.pop(prefix + '_sec', None)
+        constants.pop(prefix + '_ns', None)
+    return constants, combined
+
+
+def convert(fname, ofname, chunk_frames=4096, compression='gzip',
+            compression_opts=4, shuffle=True, delta=False, block_chunks=16):
+    """
+    Converts the binary file fname produced by the MPS4264
+    pressure scanner to the archival format, without loss.
+
+    Input:
+        fname            : (str) Path to the file created by the
+                           pressure scanner.
+        ofname           : (str) Path to the output HDF5 file.
+                           NOTE: This will overwrite an existing
+                           file!
+        chunk_frames     : (int) Frames per chunk, the smallest
+                           unit that is decompressed. Default: 4096
+        compression      : (str or None) HDF5 compression filter,
+                           e.g. 'gzip' or 'lzf'. Default: 'gzip'
+        compression_opts : (int or None) Level of 'gzip'.
+                           Default: 4
+        shuffle          : (bool) Byte shuffle before compression.
+                           Default: True
+        delta            : (bool) Delta code the pressures and
+                           temperatures within each chunk as well.
+                           Default: False
+        block_chunks     : (int) Chunks converted at a time, which
+                           bounds the memory use. Default: 16
+    """
+    block_frames = chunk_frames * block_chunks
+    num_points = os.path.getsize(fname) // rpsb.FRAME_BYTES
+    constants, combined = _scan_layout(fname, block_frames)
+
+    options = dict(compression=compression, shuffle=shuffle)
+    if compression == 'gzip':
+        options['compression_opts'] = compression_opts
+
+    # Columns of the archive: (dataset name, function of a block, delta coded)
+    columns = []
+    for key in rpsb.FRAME_DTYPE.names:
+        prefix = key.rsplit('_', 1)[0]
+        if key in constants:
+            continue
+        if prefix in combined:
+            if key.endswith('_sec'):
+                columns.append(('time_ns/' + prefix, _combine_time(prefix), True))
+        elif key in ARRAY_FIELDS:
+            columns.append(('frames/' + key, _field(key), delta))
+        else:
+            columns.append(('frames/' + key, _field(key), key in DELTA_FIELDS))
+
+    with h5py.File(ofname, 'w') as h5f:
+        h5f.attrs['format_version'] = FORMAT_VERSION
+        h5f.attrs['num_frames'] = num_points
+        h5f.attrs['chunk_frames'] = chunk_frames
+        h5f.attrs['source'] = os.path.basename(fname)
+        with open(fname, 'rb') as fp:
+            fp.seek(num_points * rpsb.FRAME_BYTES)
+            h5f.attrs['trailing_bytes'] = np.frombuffer(fp.read(), dtype=np.uint8)
+        group = h5f.create_group('frames')
+        for key, value in constants.items():
+            group.attrs[key] = value
+        h5f.create_group('time_ns')
+
+        datasets = []
+        frames = rpsb._load_frames(fname, mmap=True)
+        for name, column, delta_coded in columns:
+            sample = column(frames[:1])
+            shape = (num_points,) + sample.shape[1:]
+            chunks = (max(1, min(chunk_frames, num_points)),) + sample.shape[1:]
+            dataset = h5f.create_dataset(name, shape=shape, dtype=sample.dtype,
+                                         chunks=chunks if num_points else None,
+                                         **(options if num_points else {}))
+            dataset.attrs['delta'] = delta_coded
+            datasets.append((dataset, column, delta_coded))
+
+        for start in range(0, num_points, block_frames):
+            block = np.array(frames[start:start + block_frames])
+            for dataset, column, delta_coded in datasets:
+                values = column(block)
+                if delta_coded:
+                    values = _delta_encode(values, chunk_frames)
+                dataset[start:start + len(block)] = values
+
+
+def _field(key):
+    """Column of the field key of a block of frames."""
+    return lambda block: np.ascontiguousarray(block[key])
+
+
+def _combine_time(prefix):
+    """Column of the timestamp prefix in nanoseconds of a block of frames."""
+    def column(block):
+        time_ns = block[prefix + '_sec'].astype(np.int64)
+        time_ns *= 1000000000
+        time_ns += block[prefix + '_ns']
+        return time_ns
+    return column
+
+
+class ArchivedScan:
+    """
+    Read access to a pressure scanner file converted with
+    convert. Any range of frames can be read, and only the
+    chunks containing it are decompressed.
+
+    Usage:
+        with ArchivedScan(fname) as scan:
+            time, pressure = scan.read(1000, 2000)
+            frame_rate = scan.field('frame_rate', 0, 1)
+
+    Input:
+        fname : (str) Path to the archive.
+    """
+
+    def __init__(self, fname):
+        self._h5f = h5py.File(fname, 'r')
+        self.num_frames = int(self._h5f.attrs['num_frames'])
+        self.chunk_frames = int(self._h5f.attrs['chunk_frames'])
+        self.constants = OrderedDict(self._h5f['frames'].attrs.items())
+
+    def __len__(self):
+        return self.num_frames
+
+    def _range(self, start, stop):
+        if stop is None or stop > self.num_frames:
+            stop = self.num_frames
+        start = max(0, min(start, stop))
+        return start, stop
+
+    def _column(self, name, start, stop):
+        dataset = self._h5f[name]
+        if not dataset.attrs['delta']:
+            return dataset[start:stop]
+        # Decode from the start of the first chunk of the range
+        first = start - start % self.chunk_frames
+        return _delta_decode(dataset[first:stop], self.chunk_frames)[start - first:]
+
+    def field(self, key, start=0, stop=None):
+        """
+        Returns the field key of FRAME_DTYPE for the frames
+        [start, stop), with time as the first index.
+        """
+        start, stop = self._range(start, stop)
+        dtype = rpsb.FRAME_DTYPE[key]
+        if key in self.constants:
+            return np.full(stop - start, self.constants[key], dtype=dtype)
+        prefix, _, part = key.rpartition('_')
+        if part in ('sec', 'ns') and 'time_ns/' + prefix in self._h5f:
+            sec, ns = np.divmod(self._column('time_ns/' + prefix, start, stop), 1000000000)
+            return (sec if part == 'sec' else ns).astype(dtype.base)
+        return self._column('frames/' + key, start, stop)
+
+    def frames(self, start=0, stop=None):
+        """
+        Returns the frames [start, stop) as a structured
+        array of FRAME_DTYPE, identical to the original.
+        """
+        start, stop = self._range(start, stop)
+        frames = np.empty(stop - start, dtype=rpsb.FRAME_DTYPE)
+        for key in rpsb.FRAME_DTYPE.names:
+            frames[key] = self.field(key, start, stop)
+        return frames
+
+    def _t0(self):
+        """PTP scan start time of the first frame, as in read_press_scan_binary."""
+        return self.field('PTP_scan_start_time_sec', 0, 1)[0] \
+            + self.field('PTP_scan_start_time_ns', 0, 1)[0] * 1e-9
+
+    def read(self, start=0, stop=None):
+        """
+        Returns the time and pressure of the frames [start,
+        stop) as read_press_scan_binary.read (the time is
+        relative to the scan start time of the first frame
+        of the capture, as in iter_frames).
+        """
+        start, stop = self._range(start, stop)
+        if stop == start:
+            return np.zeros(0), np.zeros((64, 0), dtype=np.float32)
+        frame_time = OrderedDict()
+        for key in ('frame_time_sec', 'frame_time_ns'):
+            frame_time[key] = self.field(key, start, stop)
+        pressure = self.field('pressures', start, stop)
+        return rpsb._frame_time(frame_time, self._t0()), pressure.T
+
+    def read_full(self, start=0, stop=None):
+        """
+        Returns all the fields of the frames [start, stop) as
+        read_press_scan_binary.read_full.
+        """
+        data = OrderedDict()
+        for key in rpsb.FRAME_DTYPE.names:
+            data[key] = self.field(key, start, stop)
+        data['temperatures'] = data['temperatures'].T
+        data['pressures'] = data['pressures'].T
+        return data
+
+    def to_binary(self, ofname, block_frames=65536):
+        """
+        Writes the capture back to the binary format of the
+        pressure scanner, byte for byte identical to the
+        original file. NOTE: This will overwrite an existing
+        file!
+        """
+        with open(ofname, 'wb') as fp:
+            for start in range(0, self.num_frames, block_frames):
+                self.frames(start, start + block_frames).tofile(fp)
+            fp.write(self._h5f.attrs['trailing_bytes'].tobytes())
+
+    def close(self):
+        """Closes the file."""
+        self._h5f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read(fname, start=0, stop=None):
+    """
+    Reads the frames [start, stop) of an archive created by
+    convert, see read_press_scan_binary.read for the output.
+    """
+    with ArchivedScan(fname) as scan:
+        return scan.read(start, stop)
+
+
+def read_full(fname, start=0, stop=None):
+    """
+    Reads all the fields of the frames [start, stop) of an
+    archive created by convert, see
+    read_press_scan_binary.read_full for the output.
+    """
+    with ArchivedScan(fname) as scan:
+        return scan.read_full(start, stop)
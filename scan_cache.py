@@ -0,0 +1,226 @@
+###########################################################################
+# On-disk cache of decoded and reduced pressure scanner files.
+#
+# The decoded arrays are stored as .npy files in a cache directory,
+# keyed by the path, size, modification time and a fast hash of the
+# content of the .dat file. An entry is invalidated as soon as any of
+# them change, and the least recently used entries are evicted when the
+# cache grows larger than max_bytes.
+#
+# Usage:
+#     cache = ScanCache('.scan_cache')
+#     time, pressure = cache.read('raw_data/Group13_370k_a10.dat')
+#     p_mean = cache.port_mean('raw_data/Group13_370k_a10.dat')
+#     cache.stats
+###########################################################################
+
+import hashlib
+import io
+import json
+import os
+import time as timer
+
+import numpy as np
+
+import read_press_scan_binary as rpsb
+import scan_stats
+
+# Bytes hashed at the start, middle and end of a file
+HASH_BLOCK = 1 << 20
+
+
+def content_hash(fname):
+    """
+    Returns a fast hash (str) of the file fname, computed
+    from its size and three blocks of HASH_BLOCK bytes at
+    the start, middle and end of the file.
+    """
+    size = os.path.getsize(fname)
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with io.open(fname, 'rb') as fp:
+        for pos in sorted({0, max(0, size // 2 - HASH_BLOCK // 2),
+                           max(0, size - HASH_BLOCK)}):
+            fp.seek(pos)
+            h.update(fp.read(HASH_BLOCK))
+    return h.hexdigest()
+
+
+def _decode(fname):
+    """Decodes fname, with time as the first index of the pressure."""
+    time, pressure = rpsb.read(fname)
+    return time, np.ascontiguousarray(pressure.T)
+
+
+class ScanCache:
+    """
+    Cache of the decoded (read) and time-averaged (port_mean)
+    pressure scanner files.
+
+    The statistics in self.stats are counted in the process
+    that calls read and port_mean. Worker processes return
+    theirs with port_mean_counted, to be added to the cache
+    of the parent with merge_stats.
+
+    Input:
+        directory : (str) Directory of the cache, created if
+                    it does not exist.
+        max_bytes : (int) Maximum total size of the cached
+                    arrays. Larger entries are computed but
+                    not stored. Default: 2 GB
+    """
+
+    def __init__(self, directory, max_bytes=2 * 1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0,
+                      'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_name(self, entry_key):
+        return hashlib.blake2b(entry_key.encode(), digest_size=8).hexdigest()
+
+    def _load_index(self):
+        """
+        Returns all entries of the cache. Every entry is stored
+        in its own .json file next to its arrays, so that
+        processes sharing the cache do not overwrite each
+        other's entries.
+        """
+        index = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with io.open(os.path.join(self.directory, name), 'r') as fp:
+                    entry = json.load(fp)
+            except (FileNotFoundError, ValueError):
+                continue
+            index[entry['key']] = entry
+        return index
+
+    def _load_entry(self, entry_key):
+        """Returns the entry of entry_key, None if it is not cached."""
+        fname = os.path.join(self.directory, self._entry_name(entry_key) + '.json')
+        try:
+            with io.open(fname, 'r') as fp:
+                entry = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return None
+        return entry if entry.get('key') == entry_key else None
+
+    def _save_entry(self, entry):
+        # Write to a temporary file first, so that an entry is never
+        # left half written
+        fname = os.path.join(self.directory, self._entry_name(entry['key']) + '.json')
+        tmp_fname = '{:s}.{:d}.tmp'.format(fname, os.getpid())
+        with io.open(tmp_fname, 'w') as fp:
+            json.dump(entry, fp)
+        os.replace(tmp_fname, fname)
+
+    def _remove(self, entry):
+        names = entry['files'] + [self._entry_name(entry['key']) + '.json']
+        for name in names:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def _get(self, fname, kind, compute):
+        """
+        Returns the arrays cached for kind of fname, calling
+        compute(fname) to create them (tuple of ndarrays) on
+        a miss.
+        """
+        fname = os.path.abspath(fname)
+        stat = os.stat(fname)
+        file_hash = content_hash(fname)
+        entry_key = kind + ':' + fname
+
+        # Only the entry's own sidecar is read on a lookup
+        entry = self._load_entry(entry_key)
+        if entry is not None:
+            valid = (entry['size'] == stat.st_size
+                     and entry['mtime_ns'] == stat.st_mtime_ns
+                     and entry['hash'] == file_hash)
+            if valid:
+                try:
+                    arrays = tuple(np.load(os.path.join(self.directory, name))
+                                   for name in entry['files'])
+                except (FileNotFoundError, ValueError):
+                    valid = False
+            if valid:
+                self.stats['hits'] += 1
+                entry['last_access'] = timer.time()
+                self._save_entry(entry)
+                return arrays
+            self.stats['invalidations'] += 1
+            self._remove(entry)
+
+        self.stats['misses'] += 1
+        arrays = compute(fname)
+        nbytes = int(sum(array.nbytes for array in arrays))
+        if nbytes > self.max_bytes:
+            # Storing it would evict every other entry and then itself
+            return arrays
+        entry_name = self._entry_name(entry_key)
+        files = []
+        for ind, array in enumerate(arrays):
+            name = '{:s}_{:d}.npy'.format(entry_name, ind)
+            np.save(os.path.join(self.directory, name), array)
+            files.append(name)
+        entry = {'key': entry_key, 'size': stat.st_size,
+                 'mtime_ns': stat.st_mtime_ns, 'hash': file_hash,
+                 'files': files,
+                 'nbytes': nbytes,
+                 'last_access': timer.time()}
+        self._save_entry(entry)
+        self._evict(self._load_index())
+        return arrays
+
+    def _evict(self, index):
+        """Removes the least recently used entries until the cache fits."""
+        total = sum(entry['nbytes'] for entry in index.values())
+        for entry_key in sorted(index, key=lambda key: index[key]['last_access']):
+            if total <= self.max_bytes:
+                break
+            total -= index[entry_key]['nbytes']
+            self._remove(index.pop(entry_key))
+            self.stats['evictions'] += 1
+
+    def read(self, fname):
+        """
+        Cached version of read_press_scan_binary.read(fname).
+        """
+        time, pressure = self._get(fname, 'read', _decode)
+        return time, pressure.T
+
+    def port_mean(self, fname):
+        """
+        Cached version of scan_stats.port_mean(fname).
+        """
+        return self._get(fname, 'mean',
+                         lambda fname: (scan_stats.port_mean(fname),))[0]
+
+    def port_mean_counted(self, fname):
+        """
+        Returns port_mean(fname) and the changes (dict) of
+        self.stats of the call, for use in worker processes.
+        """
+        before = dict(self.stats)
+        p_mean = self.port_mean(fname)
+        return p_mean, {key: self.stats[key] - before[key] for key in self.stats}
+
+    def merge_stats(self, stats):
+        """Adds the statistics (dict) of another process to self.stats."""
+        for key, value in stats.items():
+            self.stats[key] += value
+
+    @property
+    def nbytes(self):
+        """Total size of the cached arrays."""
+        return sum(entry['nbytes'] for entry in self._load_index().values())
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        for entry in self._load_index().values():
+            self._remove(entry)
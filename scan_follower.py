@@ -0,0 +1,201 @@
+###########################################################################
+# Live monitoring of a pressure scanner file that is still being written.
+#
+# The MPS4264 appends 348-byte frames to the .dat file during a run. The
+# follower polls the file size, decodes only the newly completed frames
+# and keeps a partially written trailing frame buffered until the rest
+# of it arrives.
+#
+# Usage:
+#     follower = ScanFollower('raw_data/Group13_370k_a10.dat', window=500)
+#     for num_new in follower.follow(interval=0.2):
+#         print(follower.rolling_mean[inds_upper])
+#
+# Run this file to follow a synthetic file written by a separate process:
+#     python scan_follower.py
+###########################################################################
+
+import io
+import multiprocessing
+import os
+import time as timer
+
+import numpy as np
+
+import read_press_scan_binary as rpsb
+from scan_stats import RunningStats
+
+
+class ScanFollower:
+    """
+    Follows a growing pressure scanner file and keeps the
+    statistics of all frames read so far, as well as the
+    rolling mean over the last window frames.
+
+    Input:
+        fname  : (str) Path to the file written by the
+                 pressure scanner.
+        window : (int) Number of frames in the rolling
+                 mean. Default: 500
+    """
+
+    def __init__(self, fname, window=500):
+        self.fname = fname
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        """Forgets everything read so far."""
+        self.stats = RunningStats()
+        self._pos = 0
+        self._partial = b''
+        self._t0 = None
+        self._ring = np.zeros((self.window, 64))
+        self._ring_time = np.zeros(self.window)
+        self._ring_pos = 0
+
+    @property
+    def num_points(self):
+        """Number of frames read so far."""
+        return self.stats.count
+
+    @property
+    def rolling_mean(self):
+        """Mean pressure of each port over the last window frames."""
+        n = min(self.num_points, self.window)
+        if n == 0:
+            return np.full(64, np.nan)
+        return self._ring[:n].mean(axis=0)
+
+    @property
+    def last_time(self):
+        """Time of the last frame read, or None."""
+        if self.num_points == 0:
+            return None
+        return self._ring_time[(self._ring_pos - 1) % self.window]
+
+    def poll(self):
+        """
+        Reads the frames completed since the last call.
+
+        Output:
+            time     : (ndarray, 1D) Timestamp of the new frames.
+            pressure : (ndarray, 2D) Pressure of the new frames,
+                       first index is the pressure port, second
+                       index is point in time.
+        """
+        try:
+            size = os.path.getsize(self.fname)
+        except FileNotFoundError:
+            size = 0
+        if size < self._pos:
+            # The file was truncated or replaced, start over
+            self.reset()
+        if size == self._pos:
+            return np.zeros(0), np.zeros((64, 0), dtype=np.float32)
+
+        with io.open(self.fname, 'rb') as fp:
+            fp.seek(self._pos)
+            new_data = fp.read(size - self._pos)
+        self._pos += len(new_data)
+
+        buff = self._partial + new_data
+        num_frames = len(buff) // rpsb.FRAME_BYTES
+        end = num_frames * rpsb.FRAME_BYTES
+        self._partial = buff[end:]
+        frames = np.frombuffer(buff, dtype=rpsb.FRAME_DTYPE, count=num_frames)
+        if num_frames == 0:
+            return np.zeros(0), np.zeros((64, 0), dtype=np.float32)
+
+        if self._t0 is None:
+            self._t0 = frames['PTP_scan_start_time_sec'][0] \
+                       + frames['PTP_scan_start_time_ns'][0] * 1e-9
+        time = rpsb._frame_time(frames, self._t0)
+        pressure = frames['pressures'].T
+        self.stats.update(pressure)
+        self._push(time, frames['pressures'])
+
+        return time, pressure
+
+    def _push(self, time, pressure):
+        """Adds frames (time first) to the rolling window."""
+        n = len(time)
+        if n >= self.window:
+            self._ring[:] = pressure[-self.window:]
+            self._ring_time[:] = time[-self.window:]
+            self._ring_pos = 0
+            return
+        inds = (self._ring_pos + np.arange(n)) % self.window
+        self._ring[inds] = pressure
+        self._ring_time[inds] = time
+        self._ring_pos = (self._ring_pos + n) % self.window
+
+    def follow(self, interval=0.1, timeout=None, idle_timeout=None):
+        """
+        Polls the file until stopped. Yields the number of new
+        frames every time new frames have been decoded.
+
+        Input:
+            interval     : (float) Seconds between polls.
+                           Default: 0.1
+            timeout      : (float or None) Stop after this
+                           many seconds. Default: None
+            idle_timeout : (float or None) Stop if the file
+                           has not grown for this many seconds.
+                           Default: None
+        """
+        start = last_growth = timer.monotonic()
+        while True:
+            time, _ = self.poll()
+            now = timer.monotonic()
+            if len(time) > 0:
+                last_growth = now
+                yield len(time)
+            if timeout is not None and now - start > timeout:
+                return
+            if idle_timeout is not None and now - last_growth > idle_timeout:
+                return
+            timer.sleep(interval)
+
+
+def _write_growing_file(fname, num_points, frame_rate, chunk_bytes):
+    """
+    Appends synthetic frames to fname in real time, in
+    pieces of chunk_bytes so that frames are split between
+    writes as they may be by the pressure scanner.
+    """
+    frames = np.zeros(num_points, dtype=rpsb.FRAME_DTYPE)
+    t_ns = np.round(np.arange(num_points) * 1e9 / frame_rate).astype(np.int64)
+    frames['frame_number'] = np.arange(1, num_points + 1)
+    frames['frame_time_sec'] = t_ns // 1000000000
+    frames['frame_time_ns'] = t_ns % 1000000000
+    frames['pressures'] = np.linspace(-300, 100, 64) \
+        + np.random.default_rng(0).standard_normal((num_points, 64)) * 5
+    bin_data = frames.tobytes()
+    delay = chunk_bytes / rpsb.FRAME_BYTES / frame_rate
+    with io.open(fname, 'ab', buffering=0) as fp:
+        for start in range(0, len(bin_data), chunk_bytes):
+            fp.write(bin_data[start:start + chunk_bytes])
+            timer.sleep(delay)
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        fname = os.path.join(directory, 'live.dat')
+        open(fname, 'wb').close()
+        writer = multiprocessing.Process(target=_write_growing_file,
+                                         args=(fname, 2000, 500.0, 1000))
+        writer.start()
+
+        follower = ScanFollower(fname, window=250)
+        for num_new in follower.follow(interval=0.05, idle_timeout=1.0):
+            print('{:6d} frames  t = {:6.3f} s  mean(port 0) = {:7.2f}'.format(
+                follower.num_points, follower.last_time, follower.rolling_mean[0]))
+        writer.join()
+
+        _, pressure = rpsb.read(fname)
+        assert follower.num_points == pressure.shape[1]
+        assert np.allclose(follower.stats.mean, pressure.mean(axis=1))
+        print('Followed all {:d} frames'.format(follower.num_points))
@@ -0,0 +1,349 @@
+###########################################################################
+# Streaming statistics of the pressure scanner signals.
+#
+# The statistics are accumulated block by block from
+# read_press_scan_binary.iter_frames, so the memory use does not depend
+# on the length of the capture: moments (mean, RMS, skewness, kurtosis)
+# and Welch spectra and coherence of all 64 ports.
+###########################################################################
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+import scipy.signal
+
+import profiling
+import read_press_scan_binary as rpsb
+
+
+class RunningStats:
+    """
+    Running count, mean, variance, skewness, kurtosis,
+    minimum and maximum of each port of the pressure
+    scanner. Blocks are merged with the parallel algorithm
+    of Chan et al. extended to the third and fourth
+    moments by Pebay, which is numerically stable for long
+    captures.
+
+    Usage:
+        stats = RunningStats()
+        for _, p in rpsb.iter_frames(fname):
+            stats.update(p)
+        stats.mean, stats.std
+    """
+
+    def __init__(self, num_ports=64):
+        self.count = 0
+        self.mean = np.zeros(num_ports)
+        self.m2 = np.zeros(num_ports)
+        self.m3 = np.zeros(num_ports)
+        self.m4 = np.zeros(num_ports)
+        self.min = np.full(num_ports, np.inf)
+        self.max = np.full(num_ports, -np.inf)
+
+    def update(self, block):
+        """
+        Adds a block of samples to the statistics.
+
+        Input:
+            block : (ndarray, 2D) First index is the port,
+                    second index is point in time.
+        """
+        n = block.shape[1]
+        if n == 0:
+            return
+        # Reduce with time as the first index, so that all ports are
+        # handled in the same pass over the frames
+        samples = block.T
+        block_mean = samples.sum(axis=0, dtype=np.float64) / n
+        dev = samples - block_mean
+        dev2 = dev * dev
+        block_m2 = dev2.sum(axis=0)
+        block_m3 = np.einsum('ij,ij->j', dev2, dev)
+        block_m4 = np.einsum('ij,ij->j', dev2, dev2)
+        self._merge(n, block_mean, block_m2, block_m3, block_m4)
+        np.minimum(self.min, samples.min(axis=0), out=self.min)
+        np.maximum(self.max, samples.max(axis=0), out=self.max)
+
+    def combine(self, other):
+        """Adds the statistics of another RunningStats."""
+        if other.count == 0:
+            return
+        self._merge(other.count, other.mean, other.m2, other.m3, other.m4)
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+
+    def _merge(self, n_b, mean_b, m2_b, m3_b, m4_b):
+        n_a, mean_a, m2_a, m3_a = self.count, self.mean, self.m2, self.m3
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        self.m4 = self.m4 + m4_b \
+            + delta**4 * n_a * n_b * (n_a**2 - n_a * n_b + n_b**2) / n**3 \
+            + 6 * delta**2 * (n_a**2 * m2_b + n_b**2 * m2_a) / n**2 \
+            + 4 * delta * (n_a * m3_b - n_b * m3_a) / n
+        self.m3 = m3_a + m3_b + delta**3 * n_a * n_b * (n_a - n_b) / n**2 \
+            + 3 * delta * (n_a * m2_b - n_b * m2_a) / n
+        self.m2 = m2_a + m2_b + delta**2 * (n_a * n_b / n)
+        self.mean = mean_a + delta * (n_b / n)
+        self.count = n
+
+    @property
+    def var(self):
+        """Sample variance (ddof=1) of each port."""
+        if self.count < 2:
+            return np.full_like(self.mean, np.nan)
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        """Sample standard deviation (ddof=1) of each port."""
+        return np.sqrt(self.var)
+
+    @property
+    def rms(self):
+        """
+        Root mean square of the fluctuations (ddof=0) of each
+        port. Divide by q_inf to get the RMS of Cp'.
+        """
+        return np.sqrt(self.m2 / self.count)
+
+    @property
+    def skewness(self):
+        """Skewness (biased, as scipy.stats.skew) of each port."""
+        return np.sqrt(self.count) * self.m3 / self.m2**1.5
+
+    @property
+    def kurtosis(self):
+        """Excess kurtosis (biased, as scipy.stats.kurtosis) of each port."""
+        return self.count * self.m4 / self.m2**2 - 3
+
+
+def port_stats(fname, chunk_frames=16384):
+    """
+    Computes the running statistics of every port in the
+    pressure scanner file given by fname with constant
+    memory.
+
+    Input:
+        fname        : (str) Path to the file created by
+                       the pressure scanner.
+        chunk_frames : (int) Number of frames read at a
+                       time. Default: 16384
+
+    Output:
+        stats : (RunningStats) Statistics of all ports,
+                e.g. stats.mean is the time-average.
+    """
+    stats = RunningStats()
+    for _, pressure in rpsb.iter_frames(fname, chunk_frames):
+        stats.update(pressure)
+    return stats
+
+
+def port_mean(fname, chunk_frames=16384):
+    """
+    Returns the time-averaged pressure (ndarray, 1D) of
+    every port in the file given by fname, computed with
+    constant memory. Faster than port_stats when only the
+    mean is needed.
+    """
+    total = np.zeros(64)
+    count = 0
+    with profiling.stage('scan_stats.port_mean') as st:
+        for _, pressure in rpsb.iter_frames(fname, chunk_frames):
+            # Sum with time as the first index, so that all ports are
+            # added in the same pass over the frames
+            total += pressure.T.sum(axis=0, dtype=np.float64)
+            count += pressure.shape[1]
+        st.add(frames=count)
+    if count == 0:
+        return np.full(64, np.nan)
+    return total / count
+
+
+class RunningSpectra:
+    """
+    Welch estimate of the power spectral density of every
+    port and the cross spectral density between all ports,
+    accumulated block by block. The segments overlap across
+    the blocks, so the result is the same as scipy.signal.welch
+    and scipy.signal.csd (window 'hann', detrend 'constant',
+    scaling 'density') on the whole series.
+
+    Input:
+        fs       : (float) Sample rate [Hz].
+        nperseg  : (int) Length of each segment. Default: 256
+        noverlap : (int or None) Overlap of the segments.
+                   Default: None (nperseg // 2)
+        cross    : (bool) Accumulate the cross spectra as well,
+                   needed for the coherence. Default: True
+    """
+
+    def __init__(self, fs, nperseg=256, noverlap=None, cross=True):
+        if noverlap is None:
+            noverlap = nperseg // 2
+        self.fs = fs
+        self.nperseg = nperseg
+        self.step = nperseg - noverlap
+        self.cross = cross
+        self.window = scipy.signal.get_window('hann', nperseg)
+        self.freq = np.fft.rfftfreq(nperseg, 1 / fs)
+        self.num_segments = 0
+        self._pxx = 0
+        self._pxy = 0
+        self._tail = None
+
+    def update(self, block):
+        """
+        Adds a block of samples, first index is the port,
+        second index is point in time.
+        """
+        if self._tail is not None:
+            block = np.concatenate([self._tail, block], axis=1)
+        num = (block.shape[1] - self.nperseg) // self.step + 1
+        if num <= 0:
+            self._tail = np.array(block)
+            return
+        # Keep the samples of the segments not complete yet
+        self._tail = np.array(block[:, num * self.step:])
+
+        segments = np.lib.stride_tricks.sliding_window_view(
+            block, self.nperseg, axis=1)[:, :num * self.step:self.step, :]
+        segments = segments - segments.mean(axis=2, keepdims=True, dtype=np.float64)
+        spectra = np.fft.rfft(segments * self.window, axis=2)
+        self._pxx = self._pxx + (spectra.real**2 + spectra.imag**2).sum(axis=1)
+        if self.cross:
+            # Sum over the segments as a matrix product for each frequency,
+            # stored as (frequency, port, port)
+            spectra = spectra.transpose(2, 0, 1)
+            self._pxy = self._pxy + np.matmul(spectra.conj(),
+                                              spectra.transpose(0, 2, 1))
+        self.num_segments += num
+
+    def combine(self, other):
+        """
+        Adds the segments of another RunningSpectra with the
+        same settings, e.g. computed on another part of the
+        series by a worker process.
+        """
+        self._pxx = self._pxx + other._pxx
+        if self.cross:
+            self._pxy = self._pxy + other._pxy
+        self.num_segments += other.num_segments
+
+    def _scale(self, values):
+        scale = np.full(len(self.freq), 2 / (self.fs * (self.window**2).sum()))
+        scale[0] /= 2
+        if self.nperseg % 2 == 0:
+            scale[-1] /= 2
+        return values * scale / self.num_segments
+
+    @property
+    def psd(self):
+        """Power spectral density of each port (port, frequency)."""
+        return self._scale(self._pxx)
+
+    @property
+    def csd(self):
+        """Cross spectral density (port, port, frequency)."""
+        return self._scale(self._pxy.transpose(1, 2, 0))
+
+    @property
+    def coherence(self):
+        """
+        Magnitude squared coherence between all ports
+        (port, port, frequency).
+        """
+        pxx = self._pxx
+        pxy = self._pxy.transpose(1, 2, 0)
+        return np.abs(pxy)**2 / (pxx[:, None, :] * pxx[None, :, :])
+
+
+def _spectral_part(fname, fs, nperseg, noverlap, cross, start, stop, chunk_frames):
+    """
+    Statistics and spectra of the segments starting in the
+    frames [start, stop) of fname, for spectral_stats.
+    """
+    spectra = RunningSpectra(fs, nperseg, noverlap, cross)
+    stats = RunningStats()
+    # Read past stop to complete the last segments
+    end = stop - spectra.step + nperseg
+    for time, pressure in rpsb.iter_frames(fname, chunk_frames, start, end):
+        last = max(0, min(len(time), stop - start))
+        stats.update(pressure[:, :last])
+        spectra.update(pressure)
+        start += len(time)
+    return stats, spectra
+
+
+def spectral_stats(fname, fs=None, nperseg=256, noverlap=None, cross=True,
+                   processes=1, chunk_frames=16384):
+    """
+    Computes the fluctuation statistics and spectra of all
+    ports of the pressure scanner file fname with bounded
+    memory, optionally split over several processes.
+
+    Input:
+        fname        : (str) Path to the file created by
+                       the pressure scanner.
+        fs           : (float or None) Sample rate [Hz].
+                       Default: None (frame_rate of the file)
+        nperseg      : (int) Segment length of the Welch
+                       estimate. Default: 256
+        noverlap     : (int or None) Overlap of the segments.
+                       Default: None (nperseg // 2)
+        cross        : (bool) Compute the cross spectra and
+                       coherence between all ports. Default: True
+        processes    : (int or None) Number of worker processes,
+                       each handles a contiguous part of the file.
+                       None uses all cores. Default: 1
+        chunk_frames : (int) Number of frames read at a time.
+                       Default: 16384
+
+    Output:
+        results : (dict) 'mean', 'std', 'rms', 'skewness' and
+                  'kurtosis' of each port, 'freq' [Hz], 'psd'
+                  (port, frequency) and, if cross is True,
+                  'csd' and 'coherence' (port, port, frequency).
+                  Divide rms by q_inf for the RMS of Cp', and the
+                  psd by q_inf**2 for the spectra of Cp'.
+    """
+    num_points = os.path.getsize(fname) // rpsb.FRAME_BYTES
+    if fs is None:
+        fs = float(np.fromfile(fname, dtype=rpsb.FRAME_DTYPE, count=1)['frame_rate'][0])
+    if processes is None:
+        processes = os.cpu_count()
+    step = nperseg - (nperseg // 2 if noverlap is None else noverlap)
+
+    # Split the file at segment starts, so that every segment is
+    # handled by exactly one part
+    num_segments = max(0, (num_points - nperseg) // step + 1)
+    bounds = np.linspace(0, num_segments, processes + 1).round().astype(int) * step
+    bounds[-1] = num_points
+    args = [(fname, fs, nperseg, noverlap, cross, start, stop, chunk_frames)
+            for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+    if len(args) == 1:
+        parts = [_spectral_part(*args[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            parts = list(pool.map(_spectral_part, *zip(*args)))
+    stats, spectra = parts[0]
+    for part_stats, part_spectra in parts[1:]:
+        stats.combine(part_stats)
+        spectra.combine(part_spectra)
+
+    results = OrderedDict()
+    results['mean'] = stats.mean
+    results['std'] = stats.std
+    results['rms'] = stats.rms
+    results['skewness'] = stats.skewness
+    results['kurtosis'] = stats.kurtosis
+    results['freq'] = spectra.freq
+    results['psd'] = spectra.psd
+    if cross:
+        results['csd'] = spectra.csd
+        results['coherence'] = spectra.coherence
+    return results
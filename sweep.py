@@ -0,0 +1,282 @@
+###########################################################################
+# Batch processing of a full angle-of-attack sweep.
+#
+# Does the same reduction as example_script.example_calculation, but the
+# metadata and the offset measurements are loaded once per dataset and
+# the pressure scanner files of the angles are reduced in parallel.
+#
+# Usage:
+#     results = run_sweep('raw_data/', 'Group13_370k')
+#     results['alpha'], results['Cp_upper'], results['Re_c']
+###########################################################################
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import fluid_prop
+import functions as fnc
+import read_mat
+import scan_stats
+from airfoil_geometry import S826
+from drift import OffsetDrift
+
+# Fields of the metadata used by the sweep
+META_FIELDS = ['alphas', 'upper_ind', 'lower_ind', 'x_surf_up_real',
+               'x_surf_low_real', 't_stamp', 't_stamp_0_1', 't_stamp_0_2',
+               'data_q_0_1', 'data_q_0_2', 'Vqfactor', 'Patm', 'Patm_end', 'c']
+
+
+def load_campaign(data_directory, group_name_prefix, cache=None):
+    """
+    Loads the metadata and the temporal means of the two
+    offset measurements of a dataset.
+
+    Input:
+        data_directory    : (str) Directory of the raw data.
+        group_name_prefix : (str) Prefix of the files, e.g.
+                            'Group13_370k'
+        cache             : (ScanCache or None) Cache for the
+                            offset means. Default: None
+
+    Output:
+        campaign : (dict) The META_FIELDS of the metadata,
+                   the temporal means of the raw pitot and
+                   thermocouple data of each angle as
+                   'data_q_raw_mean' and 'data_T_raw_mean',
+                   and the offset means of all ports as
+                   'PS_offset_1' and 'PS_offset_2'.
+    """
+    prefix = data_directory + group_name_prefix
+    with read_mat.MatFile(prefix + '_dataset.mat') as mat:
+        campaign = OrderedDict((key, mat[key]) for key in META_FIELDS)
+        # Only the temporal means of the raw pitot and thermocouple data are
+        # needed, so they are read a block of angles at a time
+        for key in ['data_q_raw', 'data_T_raw']:
+            campaign[key + '_mean'] = _row_means(mat, key)
+    campaign['data_directory'] = data_directory
+    campaign['group_name_prefix'] = group_name_prefix
+    port_mean = scan_stats.port_mean if cache is None else cache.port_mean
+    campaign['PS_offset_1'] = port_mean(prefix + '_offset1.dat')
+    campaign['PS_offset_2'] = port_mean(prefix + '_offset2.dat')
+    return campaign
+
+
+def _row_means(mat, key, block_size=2**22):
+    """
+    Means of each row (angle) of the field key of the MatFile
+    mat, read a block of rows of at most about block_size
+    values at a time.
+    """
+    shape = mat.shape(key)
+    if len(shape) < 2:
+        return np.atleast_1d(np.mean(mat.read(key)))
+    num_rows, num_values = shape
+    step = max(1, block_size // max(1, num_values))
+    means = np.empty(num_rows)
+    for start in range(0, num_rows, step):
+        rows = mat.read(key, np.s_[start:start + step, :])
+        means[start:start + step] = rows.mean(axis=1)
+    return means
+
+
+def _linear_drift(t, t1, t2, value_1, value_2):
+    """
+    Linear interpolation between value_1 at t1 and value_2
+    at t2, evaluated at the times t. The last axis of the
+    output is time.
+    """
+    weight = (np.asarray(t, dtype=np.float64) - t1) / (t2 - t1)
+    value_1 = np.asarray(value_1, dtype=np.float64)[..., None]
+    value_2 = np.asarray(value_2, dtype=np.float64)[..., None]
+    return value_1 + (value_2 - value_1) * weight
+
+
+def reduce_sweep(campaign, alpha_list=None, processes=None, cache=None,
+                 geometry=S826):
+    """
+    Reduces the pressure scanner files of the angles in
+    alpha_list to Cp distributions and flow properties.
+
+    Input:
+        campaign   : (dict) Output of load_campaign.
+        alpha_list : (list or None) Angles of attack to
+                     process. Default: all angles of the
+                     dataset.
+        processes  : (int or None) Number of worker processes
+                     for the pressure scanner files, 1 runs
+                     everything in this process. Default: None
+                     (number of cores)
+        cache      : (ScanCache or None) Cache for the temporal
+                     means of the pressure scanner files.
+                     Default: None
+        geometry   : (AirfoilGeometry) Tap geometry used for
+                     the force integration. Default: S826
+
+    Output:
+        results : (dict) Table with one row per angle with the
+                  columns 'alpha', 'q_inf' [Pa], 'T_inf' [deg C],
+                  'P_atm' [mmHg], 'rho', 'mu', 'U_inf' [m/s],
+                  'Re_c', 'Cp_upper' and 'Cp_lower' (2D, angle
+                  by tap), the integrated 'C_l', 'C_d', 'C_n',
+                  'C_a' and 'C_m' (see fnc.calc_coefficients),
+                  and 'x_upper', 'x_lower' (1D, x/c of the
+                  taps).
+    """
+    alphas = np.asarray(campaign['alphas'], dtype=int)
+    if alpha_list is None:
+        alpha_list = alphas
+    alpha_list = np.atleast_1d(np.asarray(alpha_list, dtype=int))
+    alpha_index = np.array([np.flatnonzero(alphas == alpha)[0] for alpha in alpha_list])
+
+    # Reduce the pressure scanner files, the only expensive step
+    prefix = campaign['data_directory'] + campaign['group_name_prefix']
+    fnames = [prefix + '_a' + str(alpha) + '.dat' for alpha in alpha_list]
+    port_mean = scan_stats.port_mean if cache is None else cache.port_mean
+    if processes == 1 or len(fnames) == 1:
+        p_mean = [port_mean(fname) for fname in fnames]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            if cache is None:
+                p_mean = list(pool.map(port_mean, fnames))
+            else:
+                # The workers count the hits and misses in their own copy
+                # of the cache, so add them to the statistics of this one
+                p_mean = []
+                for mean, stats in pool.map(cache.port_mean_counted, fnames):
+                    cache.merge_stats(stats)
+                    p_mean.append(mean)
+    p_mean = np.array(p_mean).T
+
+    # Subtract the offsets interpolated to the time of each measurement,
+    # assuming linear drift
+    t_1 = campaign['t_stamp_0_1']
+    t_2 = campaign['t_stamp_0_2']
+    t_alpha = np.atleast_1d(campaign['t_stamp'])[alpha_index]
+    drift = OffsetDrift([t_1, t_2], [campaign['PS_offset_1'], campaign['PS_offset_2']])
+    p_mean = p_mean - drift(t_alpha)
+
+    # Dynamic pressure from the pitot tube, temperature and atmospheric pressure
+    q_offset = _linear_drift(t_alpha, t_1, t_2, np.mean(campaign['data_q_0_1']),
+                             np.mean(campaign['data_q_0_2']))
+    q_alpha = (campaign['data_q_raw_mean'][alpha_index] - q_offset) * campaign['Vqfactor']
+    T_alpha = campaign['data_T_raw_mean'][alpha_index]
+    P_atm_alpha = _linear_drift(t_alpha, t_1, t_2, campaign['Patm'], campaign['Patm_end'])
+
+    # Fluid and flow properties
+    rho_alpha, mu_alpha, _, _ = fluid_prop.fluid_prop(T_alpha, P_atm_alpha)
+    nu_alpha = mu_alpha / rho_alpha
+    U_alpha = np.sqrt(2 * q_alpha / rho_alpha)
+    Re_c_alpha = U_alpha * campaign['c'] / nu_alpha
+
+    results = OrderedDict()
+    results['alpha'] = alpha_list
+    results['q_inf'] = q_alpha
+    results['T_inf'] = T_alpha
+    results['P_atm'] = P_atm_alpha
+    results['rho'] = rho_alpha
+    results['mu'] = mu_alpha
+    results['U_inf'] = U_alpha
+    results['Re_c'] = Re_c_alpha
+    results['Cp_upper'] = (p_mean[campaign['upper_ind'], :] / q_alpha).T
+    results['Cp_lower'] = (p_mean[campaign['lower_ind'], :] / q_alpha).T
+    results.update(fnc.calc_coefficients(results['Cp_upper'], results['Cp_lower'],
+                                         alpha_list, geometry))
+    results['x_upper'] = np.asarray(campaign['x_surf_up_real'])
+    results['x_lower'] = np.asarray(campaign['x_surf_low_real'])
+    return results
+
+
+def run_sweep(data_directory, group_name_prefix, alpha_list=None, processes=None,
+              cache=None):
+    """
+    Loads a dataset and reduces all its angles of attack,
+    see load_campaign and reduce_sweep.
+    """
+    campaign = load_campaign(data_directory, group_name_prefix, cache)
+    return reduce_sweep(campaign, alpha_list, processes, cache)
+
+
+def time_resolved_flow(data_directory, group_name_prefix, alpha, sample_rate=None):
+    """
+    Computes the flow properties of every sample of the pitot
+    tube and thermocouple data of one angle of attack, instead
+    of only their temporal means. Only the rows of that angle
+    are read from the metadata.
+
+    Input:
+        data_directory    : (str) Directory of the raw data.
+        group_name_prefix : (str) Prefix of the files, e.g.
+                            'Group13_370k'
+        alpha             : (int) Angle of attack.
+        sample_rate       : (float or None) Sample rate [Hz] of
+                            the pitot tube and thermocouple data.
+                            If given, the offset and atmospheric
+                            pressure drift are interpolated to the
+                            time of each sample, counted from the
+                            time stamp of the angle. If None, they
+                            are evaluated at the time stamp.
+                            Default: None
+
+    Output:
+        flow : (dict) Arrays with one value per sample: 't',
+               'q_inf', 'T_inf', 'P_atm', 'rho', 'mu', 'U_inf'
+               and 'Re_c'.
+    """
+    fields = ['alphas', 't_stamp', 't_stamp_0_1', 't_stamp_0_2', 'data_q_0_1',
+              'data_q_0_2', 'data_q_raw', 'data_T_raw', 'Vqfactor', 'Patm',
+              'Patm_end', 'c']
+    with read_mat.MatFile(data_directory + group_name_prefix + '_dataset.mat',
+                          fields) as meta:
+        alphas = np.atleast_1d(np.asarray(meta['alphas'], dtype=int))
+        alpha_index = int(np.flatnonzero(alphas == alpha)[0])
+        if len(alphas) == 1:
+            data_q_raw = np.ravel(meta['data_q_raw'])
+            data_T_raw = np.ravel(meta['data_T_raw'])
+        else:
+            data_q_raw = meta.read('data_q_raw', np.s_[alpha_index, :])
+            data_T_raw = meta.read('data_T_raw', np.s_[alpha_index, :])
+        t_1 = meta['t_stamp_0_1']
+        t_2 = meta['t_stamp_0_2']
+        t = np.full(len(data_q_raw), np.atleast_1d(meta['t_stamp'])[alpha_index],
+                    dtype=np.float64)
+        if sample_rate is not None:
+            t += np.arange(len(t)) / sample_rate
+
+        q_offset = _linear_drift(t, t_1, t_2, np.mean(meta['data_q_0_1']),
+                                 np.mean(meta['data_q_0_2']))
+        q = (data_q_raw - q_offset) * meta['Vqfactor']
+        P_atm = _linear_drift(t, t_1, t_2, meta['Patm'], meta['Patm_end'])
+        chord = meta['c']
+
+    rho, mu, _, _ = fluid_prop.fluid_prop_array(data_T_raw, P_atm)
+    U = np.sqrt(2 * q / rho)
+
+    flow = OrderedDict()
+    flow['t'] = t
+    flow['q_inf'] = q
+    flow['T_inf'] = data_T_raw
+    flow['P_atm'] = P_atm
+    flow['rho'] = rho
+    flow['mu'] = mu
+    flow['U_inf'] = U
+    flow['Re_c'] = U * chord * rho / mu
+    return flow
+
+
+def print_sweep(results):
+    """Prints the flow properties of each angle in results."""
+    print('alpha [deg]   q_inf [Pa]   T_inf [deg C]   U_inf [m/s]   Re_c [-]')
+    for ind, alpha in enumerate(results['alpha']):
+        print('{:11d}   {:10.1f}   {:13.1f}   {:11.2f}   {:8.0f}'.format(
+            alpha, results['q_inf'][ind], results['T_inf'][ind],
+            results['U_inf'][ind], results['Re_c'][ind]))
+
+
+if __name__ == "__main__":
+    data_directory = 'raw_data/'
+    group_name_prefix = 'Group13_370k'
+    alpha_list = [-8,-6,-4,-2,0,2,4,6,7,8,9,10,11,12,13,14,16,18]
+
+    print_sweep(run_sweep(data_directory, group_name_prefix, alpha_list))
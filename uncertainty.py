@@ -0,0 +1,298 @@
+###########################################################################
+# Bootstrap and Monte Carlo uncertainty of a reduced angle-of-attack sweep.
+#
+# Every resample repeats the reduction of sweep.reduce_sweep: the offset
+# drift interpolation, q from the pitot voltage and Vqfactor, the density
+# from fluid_prop, Cp, and the integration of the forces. The random part
+# of the raw series (pressure scanner, pitot tube and thermocouple) is
+# resampled with a block bootstrap, and the systematic input
+# uncertainties (thermocouple, atmospheric pressure and tap position) are
+# drawn from normal distributions. The chain is evaluated for all
+# resamples and angles at once, and the angles are split over processes.
+#
+# Usage:
+#     campaign = sweep.load_campaign('raw_data/', 'Group13_370k')
+#     ci = bootstrap_sweep(campaign, num_samples=2000)
+#     ci['C_l'], ci['C_l_low'], ci['C_l_high']
+###########################################################################
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+import fluid_prop
+import functions as fnc
+import read_mat
+import read_press_scan_binary as rpsb
+from airfoil_geometry import S826, force_weight_matrix
+
+# Quantities with confidence intervals
+CI_FIELDS = ['q_inf', 'T_inf', 'P_atm', 'rho', 'U_inf', 'Re_c',
+             'Cp_upper', 'Cp_lower', 'C_l', 'C_d', 'C_m']
+
+
+def block_means(fname, num_blocks=100, chunk_frames=16384):
+    """
+    Means of every port over num_blocks consecutive blocks of
+    equal length of the pressure scanner file fname, read
+    block by block. Frames after the last complete block are
+    left out.
+
+    Output:
+        means : (ndarray, 2D) First index is the block, second
+                index is the port.
+    """
+    num_points = os.path.getsize(fname) // rpsb.FRAME_BYTES
+    block_frames = num_points // num_blocks
+    if block_frames == 0:
+        raise ValueError('{:s} has fewer frames than blocks'.format(fname))
+    # Read a whole number of blocks at a time
+    chunk_frames = block_frames * max(1, chunk_frames // block_frames)
+    means = []
+    for _, pressure in rpsb.iter_frames(fname, chunk_frames, stop=block_frames * num_blocks):
+        blocks = pressure.T.reshape(-1, block_frames, pressure.shape[0])
+        means.append(blocks.sum(axis=1, dtype=np.float64) / block_frames)
+    return np.concatenate(means)
+
+
+def _series_block_means(series, num_blocks):
+    """Means of num_blocks blocks of equal length of each row of series."""
+    series = np.atleast_2d(np.asarray(series, dtype=np.float64))
+    block_len = series.shape[1] // num_blocks
+    if block_len == 0:
+        raise ValueError('The series have fewer samples than blocks')
+    blocks = series[:, :block_len * num_blocks].reshape(len(series), num_blocks, block_len)
+    return blocks.mean(axis=2)
+
+
+def _resample_means(rng, means, num_samples):
+    """
+    Block bootstrap of the mean: the mean of len(means) blocks
+    drawn with replacement, for num_samples resamples. The last
+    axis of the output is that of a single block mean.
+    """
+    num_blocks = len(means)
+    counts = rng.multinomial(num_blocks, np.full(num_blocks, 1 / num_blocks),
+                             size=num_samples)
+    return np.matmul(counts, means.reshape(num_blocks, -1)).reshape(
+        (num_samples,) + means.shape[1:]) / num_blocks
+
+
+def tap_force_weights(rng, geometry, sigma_tap, num_samples, max_draws=100):
+    """
+    Force weights (see functions.calc_coefficients) of
+    num_samples random tap positions, with the first index
+    of each matrix the resample.
+
+    Every tap is moved along the surface by a normal error
+    of standard deviation sigma_tap [m] in the distance from
+    the LE (surf_up and surf_low of the geometry, or x if
+    they are None), interpolated linearly between the taps.
+    Resamples where the taps leave the surface or change
+    order are drawn again. The slope of the surface at the
+    taps is kept at its nominal value, as finite differences
+    over the moved taps are dominated by the error itself
+    close to the LE.
+    """
+    weights = {}
+    for side, name, sign in (('up', 'upper', -1), ('low', 'lower', 1)):
+        x_points = getattr(geometry, 'x_points_' + side)
+        y_points = getattr(geometry, 'y_points_' + side)
+        surf = getattr(geometry, 'surf_' + side)
+        if surf is None:
+            s_points = x_points
+        else:
+            s_points = np.hstack([0, surf / 1000,
+                                  surf[-1] / 1000 + getattr(geometry, 'panel_length_' + side)[-1]])
+        s_port = np.empty((num_samples, len(s_points) - 2))
+        redraw = np.ones(num_samples, dtype=bool)
+        for _ in range(max_draws):
+            s_port[redraw] = s_points[1:-1] + rng.normal(0, sigma_tap, (np.count_nonzero(redraw),
+                                                                        s_port.shape[1]))
+            redraw = ((s_port[:, 0] <= 0) | (s_port[:, -1] >= s_points[-1])
+                      | np.any(np.diff(s_port, axis=1) <= 0, axis=1))
+            if not np.any(redraw):
+                break
+        else:
+            raise ValueError('sigma_tap = {:g} m moves the taps out of order'.format(sigma_tap))
+        x_port = np.interp(s_port, s_points, x_points)
+        y_port = np.interp(s_port, s_points, y_points)
+        weights[name] = force_weight_matrix(x_port, y_port, getattr(geometry, 'dydx_' + side),
+                                            sign, geometry.chord)
+    return weights
+
+
+def _propagate(alpha, weight, p_blocks, q_blocks, T_blocks, q_offset, shared, seeds):
+    """
+    Resamples the angles alpha and runs the reduction chain
+    for all resamples at once. weight is the time of each
+    angle relative to the offset measurements, and q_offset
+    the resampled pitot offset (resample, angle). Each angle
+    has its own seed, so the result does not depend on the
+    split over the workers. Returns the samples of CI_FIELDS
+    with the resample as the first index and the angle as
+    the second.
+    """
+    num_samples = len(shared['T_bias'])
+    num_alpha = len(alpha)
+
+    # Block bootstrap of the temporal means of each angle
+    p_mean = np.empty((num_samples, num_alpha, p_blocks.shape[2]))
+    q_raw = np.empty((num_samples, num_alpha))
+    T_raw = np.empty((num_samples, num_alpha))
+    for ind in range(num_alpha):
+        rng = np.random.default_rng(seeds[ind])
+        p_mean[:, ind] = _resample_means(rng, p_blocks[ind], num_samples)
+        q_raw[:, ind] = _resample_means(rng, q_blocks[ind], num_samples)
+        T_raw[:, ind] = _resample_means(rng, T_blocks[ind], num_samples)
+
+    # Offsets and atmospheric pressure with linear drift between the
+    # offset measurements, weight is the position in time of each angle
+    offset_1, offset_2 = shared['PS_offset_1'], shared['PS_offset_2']
+    p_mean -= offset_1[:, None, :] + (offset_2 - offset_1)[:, None, :] * weight[:, None]
+    q_alpha = (q_raw - q_offset) * shared['Vqfactor']
+    P_atm_1, P_atm_2 = shared['P_atm'][:, :1], shared['P_atm'][:, 1:]
+    P_atm_alpha = P_atm_1 + (P_atm_2 - P_atm_1) * weight
+    T_alpha = T_raw + shared['T_bias'][:, None]
+
+    rho, mu, _, _ = fluid_prop.fluid_prop_array(T_alpha, P_atm_alpha)
+    U_alpha = np.sqrt(2 * q_alpha / rho)
+
+    samples = OrderedDict()
+    samples['q_inf'] = q_alpha
+    samples['T_inf'] = T_alpha
+    samples['P_atm'] = P_atm_alpha
+    samples['rho'] = rho
+    samples['U_inf'] = U_alpha
+    samples['Re_c'] = U_alpha * shared['c'] * rho / mu
+    samples['Cp_upper'] = p_mean[..., shared['upper_ind']] / q_alpha[..., None]
+    samples['Cp_lower'] = p_mean[..., shared['lower_ind']] / q_alpha[..., None]
+    # One set of tap positions per resample, shared by the angles
+    coeffs = fnc.calc_coefficients(samples['Cp_upper'], samples['Cp_lower'],
+                                   alpha, shared['weights'])
+    for key in ('C_l', 'C_d', 'C_m'):
+        samples[key] = coeffs[key]
+    return samples
+
+
+def bootstrap_sweep(campaign, alpha_list=None, num_samples=2000, num_blocks=100,
+                    sigma_T=0.5, sigma_P_atm=0.5, sigma_tap=0.2e-3,
+                    confidence=0.95, processes=None, seed=None, geometry=S826,
+                    return_samples=False):
+    """
+    Confidence intervals of the reduced flow properties, Cp
+    distributions and force coefficients of the angles in
+    alpha_list, see the module description.
+
+    Input:
+        campaign       : (dict) Output of sweep.load_campaign.
+        alpha_list     : (list or None) Angles of attack.
+                         Default: all angles of the dataset.
+        num_samples    : (int) Number of resamples. Default: 2000
+        num_blocks     : (int) Number of blocks each raw series
+                         is split into for the block bootstrap.
+                         The blocks should be longer than the
+                         correlation time. Default: 100
+        sigma_T        : (float) Standard uncertainty of the
+                         thermocouple [deg C]. Default: 0.5
+        sigma_P_atm    : (float) Standard uncertainty of the
+                         atmospheric pressure readings [mmHg].
+                         Default: 0.5
+        sigma_tap      : (float) Standard uncertainty of the
+                         position of each tap along the surface
+                         [m], see tap_force_weights.
+                         Default: 0.2e-3
+        confidence     : (float) Level of the intervals.
+                         Default: 0.95
+        processes      : (int or None) Number of worker processes
+                         for the pressure scanner files and the
+                         resampling, 1 runs everything in this
+                         process. Default: None (number of cores)
+        seed           : (int or None) Seed of the random numbers.
+                         Default: None
+        geometry       : (AirfoilGeometry) Tap geometry. Default: S826
+        return_samples : (bool) Also return all the resamples as
+                         'samples'. Default: False
+
+    Output:
+        ci : (dict) 'alpha', 'x_upper', 'x_lower' and, for each of
+             CI_FIELDS, the mean of the resamples as the key, the
+             standard deviation as key + '_std' and the interval
+             as key + '_low' and key + '_high'. Cp_upper and
+             Cp_lower are 2D (angle by tap), the rest 1D.
+    """
+    alphas = np.asarray(campaign['alphas'], dtype=int)
+    if alpha_list is None:
+        alpha_list = alphas
+    alpha_list = np.atleast_1d(np.asarray(alpha_list, dtype=int))
+    alpha_index = np.array([np.flatnonzero(alphas == alpha)[0] for alpha in alpha_list])
+    if processes is None:
+        processes = os.cpu_count()
+    seeds = np.random.SeedSequence(seed).spawn(len(alpha_list) + 1)
+    rng = np.random.default_rng(seeds[0])
+
+    # Block means of the pressure scanner files, the only expensive step
+    prefix = campaign['data_directory'] + campaign['group_name_prefix']
+    fnames = [prefix + '_offset1.dat', prefix + '_offset2.dat'] \
+        + [prefix + '_a' + str(alpha) + '.dat' for alpha in alpha_list]
+    if processes == 1:
+        blocks = [block_means(fname, num_blocks) for fname in fnames]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            blocks = list(pool.map(block_means, fnames, [num_blocks] * len(fnames)))
+    with read_mat.MatFile(prefix + '_dataset.mat') as mat:
+        q_blocks = _series_block_means(mat['data_q_raw'], num_blocks)[alpha_index]
+        T_blocks = _series_block_means(mat['data_T_raw'], num_blocks)[alpha_index]
+    q_offset_blocks = [_series_block_means(campaign[key], num_blocks)[0]
+                       for key in ('data_q_0_1', 'data_q_0_2')]
+
+    # Resamples shared by all angles: the offset measurements and the
+    # systematic errors of the thermocouple, barometer and taps
+    t_1 = campaign['t_stamp_0_1']
+    t_2 = campaign['t_stamp_0_2']
+    weight = (np.atleast_1d(campaign['t_stamp'])[alpha_index] - t_1) / (t_2 - t_1)
+    q_offset_1, q_offset_2 = [_resample_means(rng, q_offset, num_samples)
+                              for q_offset in q_offset_blocks]
+    shared = OrderedDict()
+    shared['PS_offset_1'] = _resample_means(rng, blocks[0], num_samples)
+    shared['PS_offset_2'] = _resample_means(rng, blocks[1], num_samples)
+    shared['Vqfactor'] = campaign['Vqfactor']
+    shared['c'] = campaign['c']
+    shared['upper_ind'] = campaign['upper_ind']
+    shared['lower_ind'] = campaign['lower_ind']
+    shared['T_bias'] = rng.normal(0, sigma_T, num_samples)
+    shared['P_atm'] = np.stack([campaign['Patm'] + rng.normal(0, sigma_P_atm, num_samples),
+                                campaign['Patm_end'] + rng.normal(0, sigma_P_atm, num_samples)],
+                               axis=1)
+    shared['weights'] = tap_force_weights(rng, geometry, sigma_tap, num_samples)
+    # Pitot offset with linear drift, (resample, angle)
+    q_offset = q_offset_1[:, None] + (q_offset_2 - q_offset_1)[:, None] * weight
+
+    # Split the angles over the workers
+    parts = [part for part in np.array_split(np.arange(len(alpha_list)), processes) if len(part)]
+    args = [(alpha_list[part], weight[part], np.stack([blocks[2 + ind] for ind in part]),
+             q_blocks[part], T_blocks[part], q_offset[:, part], shared,
+             [seeds[1 + ind] for ind in part])
+            for part in parts]
+    if len(args) == 1:
+        results = [_propagate(*args[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=len(args)) as pool:
+            results = list(pool.map(_propagate, *zip(*args)))
+    samples = OrderedDict((key, np.concatenate([part[key] for part in results], axis=1))
+                          for key in CI_FIELDS)
+
+    ci = OrderedDict()
+    ci['alpha'] = alpha_list
+    tail = 100 * (1 - confidence) / 2
+    for key, values in samples.items():
+        ci[key] = values.mean(axis=0)
+        ci[key + '_std'] = values.std(axis=0, ddof=1)
+        ci[key + '_low'], ci[key + '_high'] = np.percentile(values, [tail, 100 - tail], axis=0)
+    ci['x_upper'] = np.asarray(campaign['x_surf_up_real'])
+    ci['x_lower'] = np.asarray(campaign['x_surf_low_real'])
+    if return_samples:
+        ci['samples'] = samples
+    return ci